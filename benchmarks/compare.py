@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Compare the stage timings of two benchmark results written by run.py.
+
+Exits with status 1 if any stage of the new run is slower than the baseline
+by more than the threshold factor.
+"""
+
+from argparse import ArgumentParser
+import json
+import sys
+
+def main():
+    parser = ArgumentParser(description = 'Compare two benchmark results.')
+    parser.add_argument('baseline', help = 'JSON results of the baseline run')
+    parser.add_argument('new', help = 'JSON results of the new run')
+    parser.add_argument('--threshold', '-t', type = float, default = 1.2, help = 'slowdown factor reported as a regression (default: 1.2)')
+    args = parser.parse_args()
+
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+    if baseline['counts'] != new['counts']:
+        print('warning: the runs differ in their counts: %s vs %s' % (baseline['counts'], new['counts']), file = sys.stderr)
+
+    regressions = []
+    print('%-16s %10s %10s %8s' % ('stage', 'baseline', 'new', 'ratio'))
+    for stage, seconds in new['stages'].items():
+        if stage not in baseline['stages']:
+            print('%-16s %10s %10.4f %8s' % (stage, '-', seconds, '-'))
+            continue
+        base = baseline['stages'][stage]
+        ratio = seconds / base if base > 0 else float('inf')
+        flag = ''
+        if ratio > args.threshold:
+            regressions.append(stage)
+            flag = ' !'
+        print('%-16s %10.4f %10.4f %8.2f%s' % (stage, base, seconds, ratio, flag))
+    if regressions:
+        print('regressions: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic proteomes and peptide lists for the benchmarks.
+
+The proteome is written in fasta format, optionally with the structural
+annotations (secstruct, transmembrane, confidence, accessibility) in the
+headers. Peptides are cut out of the proteins and planted into further
+proteins to reach the requested hit multiplicity; a fraction of random
+peptides without hits can be added.
+"""
+
+from argparse import ArgumentParser
+import random
+
+# approximate residue frequencies of UniProtKB
+RESIDUES = 'ACDEFGHIKLMNPQRSTVWY'
+FREQUENCIES = [ 8.3, 1.4, 5.5, 6.7, 3.9, 7.1, 2.3, 5.9, 5.8, 9.7, 2.4, 4.1, 4.7, 3.9, 5.5, 6.6, 5.4, 6.9, 1.1, 2.9 ]
+
+def runs(rng, length, symbols, weights, max_run):
+    out = []
+    left = length
+    while left:
+        n = min(left, rng.randint(1, max_run))
+        out.append('%d%s' % (n, rng.choices(symbols, weights)[0]))
+        left -= n
+    return ''.join(out)
+
+def scores(rng, length):
+    return ''.join('%02x' % rng.randint(0, 100) for i in range(length))
+
+def annotation(rng, length):
+    return 'secstruct:%s transmembrane:%s confidence:%s accessibility:%s' % (
+        runs(rng, length, 'HEGT-', [ 4, 3, 1, 1, 3 ], 15),
+        runs(rng, length, '-TS', [ 20, 2, 1 ], 25),
+        scores(rng, length),
+        scores(rng, length))
+
+def proteome(rng, n_records, mean_length):
+    seqs = []
+    for i in range(n_records):
+        length = max(20, min(int(rng.gammavariate(2, mean_length / 2)), 35000))
+        seqs.append(''.join(rng.choices(RESIDUES, FREQUENCIES, k = length)))
+    return seqs
+
+# peptides cut from random proteins and copied into multiplicity - 1 others
+def peptides(rng, seqs, n_peptides, min_length, max_length, multiplicity, misses):
+    out = []
+    for i in range(n_peptides):
+        length = rng.randint(min_length, max_length)
+        if rng.random() < misses:
+            out.append(''.join(rng.choices(RESIDUES, FREQUENCIES, k = length)))
+            continue
+        source = rng.randrange(len(seqs))
+        while len(seqs[source]) < length:
+            source = rng.randrange(len(seqs))
+        start = rng.randint(0, len(seqs[source]) - length)
+        peptide = seqs[source][start:start + length]
+        for j in range(multiplicity - 1):
+            target = rng.randrange(len(seqs))
+            seq = seqs[target]
+            if len(seq) < length: continue
+            pos = rng.randint(0, len(seq) - length)
+            seqs[target] = seq[:pos] + peptide + seq[pos + length:]
+        out.append(peptide)
+    return out
+
+def write_fasta(rng, seqs, path, secstruct):
+    with open(path, 'w') as out:
+        for i, seq in enumerate(seqs):
+            title = 'S%07d' % i
+            if secstruct:
+                title += ' ' + annotation(rng, len(seq))
+            out.write('>%s\n' % title)
+            for j in range(0, len(seq), 60):
+                out.write(seq[j:j + 60] + '\n')
+
+def generate(database, peptide_list, n_records = 5000, mean_length = 350, secstruct = False, n_peptides = 1000, min_length = 7, max_length = 25, multiplicity = 1, misses = 0.1, seed = 1):
+    rng = random.Random(seed)
+    seqs = proteome(rng, n_records, mean_length)
+    peps = peptides(rng, seqs, n_peptides, min_length, max_length, multiplicity, misses)
+    write_fasta(rng, seqs, database, secstruct)
+    with open(peptide_list, 'w') as out:
+        out.write(''.join(peptide + '\n' for peptide in peps))
+    return sum(map(len, seqs)), len(peps)
+
+def main():
+    parser = ArgumentParser(description = 'Generate a synthetic proteome and peptide list.')
+    parser.add_argument('--database', '-d', metavar = 'FILENAME', required = True, help = 'fasta file to write')
+    parser.add_argument('--peptides', '-p', metavar = 'FILENAME', required = True, help = 'peptide list to write')
+    parser.add_argument('--records', type = int, default = 5000, help = 'number of proteins (default: 5000)')
+    parser.add_argument('--mean-length', type = int, default = 350, help = 'mean protein length (default: 350)')
+    parser.add_argument('--secstruct', '-s', action = 'store_true', help = 'add structural annotations to the headers')
+    parser.add_argument('--n-peptides', type = int, default = 1000, help = 'number of peptides (default: 1000)')
+    parser.add_argument('--peptide-length', metavar = 'MIN-MAX', default = '7-25', help = 'range of peptide lengths (default: 7-25)')
+    parser.add_argument('--multiplicity', type = int, default = 1, help = 'number of proteins each peptide is found in (default: 1)')
+    parser.add_argument('--misses', type = float, default = 0.1, help = 'fraction of random peptides that are not expected to match (default: 0.1)')
+    parser.add_argument('--seed', type = int, default = 1, help = 'random seed (default: 1)')
+    args = parser.parse_args()
+
+    min_length, sep, max_length = args.peptide_length.partition('-')
+    min_length = int(min_length)
+    max_length = int(max_length) if sep else min_length
+    residues, n_peptides = generate(args.database, args.peptides, args.records, args.mean_length, args.secstruct, args.n_peptides, min_length, max_length, args.multiplicity, args.misses, args.seed)
+    print('%d records, %d residues, %d peptides' % (args.records, residues, n_peptides))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Per-stage timings of a peptide_matcher run, written as JSON.
+
+The stages follow the pipeline of PeptideMatcher.run(): fasta parsing,
+automaton build, database scan, collection of the hits into a MatchTable,
+logo aggregation, annotation (the match dictionaries with flanks and
+structural windows) and the JSON, NDJSON, TSV, gzipped TSV and xlsx
+writers. The whole run() is
+timed as well. With --repeat the fastest time of each stage is reported.
+"""
+
+from peptide_matcher.peptideMatcher import PeptideMatcher, tsv_header
+from peptide_matcher import pmDatabase, pmParallel, pmTable
+from peptide_matcher.pmWriters import open_writer
+from argparse import ArgumentParser
+from time import perf_counter
+import json
+import os
+import platform
+import sys
+import tempfile
+
+# stage, format and file name of the timed writers
+WRITERS = [
+    ('write_json', 'json', 'output.json'),
+    ('write_ndjson', 'ndjson', 'output.ndjson'),
+    ('write_tsv', 'tsv', 'output.tsv'),
+    ('write_tsv_gz', 'tsv', 'output.tsv.gz'),
+    ('write_xlsx', 'xlsx', 'output.xlsx')
+]
+
+class Timer:
+
+    def __init__(self):
+        self.times = {}
+
+    def time(self, stage, function, *args):
+        start = perf_counter()
+        result = function(*args)
+        self.times.setdefault(stage, []).append(perf_counter() - start)
+        return result
+
+def parse_fasta(database):
+    n_records = 0
+    residues = 0
+    for title, seq in database.parse():
+        n_records += 1
+        residues += len(seq)
+    return n_records, residues
+
+def build_automaton(pm):
+    pm.parse_peptides()
+    return pm.make_automaton()
+
+def scan(pm, database, automaton, workers):
+    hits = []
+    for record, end_index, key in pmParallel.scan(database, automaton, workers):
+        for peptide in pm.variants[key] if pm.variants else (key,):
+            hits.append((peptide, record, end_index - len(key) + 1, end_index + 1))
+    return hits
+
+def collect(pm, hits):
+    table = pmTable.MatchTable(pm)
+    for hit in hits:
+        table.add(*hit)
+    return table.finish()
+
+def aggregate_logos(pm, table):
+    logos = table.logos()
+    return { peptide: logos.logos(peptide) for peptide in dict.fromkeys(pm.peptide_seqs) }
+
+def annotate(pm, table, logos):
+    outputs = []
+    for peptide in pm.peptide_seqs:
+        n_logos, c_logos = logos.get(peptide, ([], []))
+        outputs.append({ 'peptide': peptide, 'matches': table.matches(peptide), 'n_logos': n_logos, 'c_logos': c_logos })
+    return outputs
+
+def write(output_format, outputs, path, sst_included):
+    writer = open_writer(output_format, path, tsv_header, sst_included)
+    for output in outputs:
+        writer.write_output(output)
+    writer.close()
+
+def run_all(pm):
+    return sum(len(output['matches']) for output in pm.run())
+
+def benchmark(database, peptides, sst_included, flanks, workers, engine, repeat, workdir, xlsx):
+    timer = Timer()
+    with open(peptides) as handle:
+        peptide_list = handle.read().split()
+    counts = {}
+    for i in range(repeat):
+        db = pmDatabase.open_database(database, sst_included)
+        if isinstance(db, pmDatabase.FastaDatabase):
+            counts['records'], counts['residues'] = timer.time('parse_fasta', parse_fasta, db)
+        pm = PeptideMatcher(peptide_list, db, sst_included, flanks, workers)
+        automaton = timer.time('build_automaton', build_automaton, pm)
+        hits = timer.time('scan', scan, pm, db, automaton, workers)
+        table = timer.time('collect', collect, pm, hits)
+        logos = timer.time('logos', aggregate_logos, pm, table)
+        outputs = timer.time('annotate', annotate, pm, table, logos)
+        for stage, output_format, name in WRITERS:
+            if output_format != 'xlsx' or xlsx:
+                timer.time(stage, write, output_format, outputs, os.path.join(workdir, name), sst_included)
+        pm = PeptideMatcher(peptide_list, database, sst_included, flanks, workers, engine = engine)
+        counts['hits'] = timer.time('run', run_all, pm)
+        counts['peptides'] = len(peptide_list)
+        if isinstance(db, pmDatabase.IndexedDatabase):
+            counts['records'] = db.n_records
+            counts['residues'] = len(db.blobs['seq']) - db.n_records
+            db.close()
+    return timer.times, counts
+
+def main():
+    parser = ArgumentParser(description = 'Time the stages of a peptide_matcher run.')
+    parser.add_argument('--database', '-d', metavar = 'FILENAME', required = True, help = 'protein database in fasta format or indexed')
+    parser.add_argument('--peptides', '-p', metavar = 'FILENAME', required = True, help = 'list of peptides to match')
+    parser.add_argument('--secstruct', '-s', action = 'store_true', help = 'whether the database also contains structural information')
+    parser.add_argument('--flanks', '-f', metavar = 'N', type = int, default = 4, help = 'length of the flanks (default: 4)')
+    parser.add_argument('--jobs', '-j', metavar = 'N', type = int, default = 1, help = 'number of worker processes scanning the database (default: 1)')
+    parser.add_argument('--engine', default = 'automaton', choices = [ 'automaton', 'suffix-array', 'auto' ], help = 'search engine of the timed run() (default: automaton)')
+    parser.add_argument('--repeat', '-r', metavar = 'N', type = int, default = 3, help = 'number of repetitions (default: 3)')
+    parser.add_argument('--no-xlsx', action = 'store_true', help = 'skip the xlsx writer')
+    parser.add_argument('--label', help = 'name of the run stored with the results')
+    parser.add_argument('--output', '-o', default = '-', help = 'JSON file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix = 'peptide_matcher_bench') as workdir:
+        times, counts = benchmark(args.database, args.peptides, args.secstruct, args.flanks, args.jobs, args.engine, args.repeat, workdir, not args.no_xlsx)
+
+    results = {
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': { 'database': args.database, 'peptides': args.peptides, 'secstruct': args.secstruct, 'flanks': args.flanks, 'jobs': args.jobs, 'engine': args.engine, 'repeat': args.repeat },
+        'counts': counts,
+        'stages': { stage: min(values) for stage, values in times.items() },
+        'runs': times
+    }
+    out = open(args.output, 'w') if args.output != '-' else sys.stdout
+    json.dump(results, out, indent = 2)
+    out.write('\n')
+    if out is not sys.stdout:
+        out.close()
+
+if __name__ == '__main__':
+    main()
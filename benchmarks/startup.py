@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Startup times of peptide_matcher in fresh interpreters, written as JSON.
+
+Every case is run --repeat times in a new Python process: the bare
+interpreter, importing the package, importing PeptideMatcher and starting
+the CLI up to its argument parsing (--help). The fastest wall time of each
+case is reported, together with the cumulative import times of the package
+modules from -X importtime. The run fails if importing PeptideMatcher or
+starting the CLI takes longer than --budget seconds more than the bare
+interpreter, or if either loads the GUI or xlsx modules. The results can be
+compared with compare.py like those of run.py.
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+import json
+import platform
+import subprocess
+import sys
+
+CASES = {
+    'interpreter': 'pass',
+    'import_package': 'import peptide_matcher',
+    'import_matcher': 'from peptide_matcher import PeptideMatcher',
+    'cli_help': 'import sys; sys.argv = [ "peptide_matcher", "--help" ]; from peptide_matcher.main import run_cli; run_cli()'
+}
+# cases held to the budget, and the modules they must not load
+BUDGET_CASES = [ 'import_matcher', 'cli_help' ]
+OPTIONAL_MODULES = [ 'wx', 'xlsxwriter' ]
+
+def time_case(code):
+    start = perf_counter()
+    subprocess.run([ sys.executable, '-c', code ], check = True, stdout = subprocess.DEVNULL)
+    return perf_counter() - start
+
+# the optional modules loaded by a case, after it ran up to the end or to sys.exit()
+def loaded_modules(code):
+    check = 'try:\n    exec(%r)\nexcept SystemExit:\n    pass\nimport sys, json\nprint(json.dumps([ name for name in %r if name in sys.modules ]))' % (code, OPTIONAL_MODULES)
+    out = subprocess.run([ sys.executable, '-c', check ], check = True, stdout = subprocess.PIPE, text = True).stdout
+    return json.loads(out.splitlines()[-1])
+
+# cumulative import time in seconds of the peptide_matcher modules
+def import_times(code):
+    err = subprocess.run([ sys.executable, '-X', 'importtime', '-c', code ], check = True, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True).stderr
+    times = {}
+    for line in err.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip().startswith('peptide_matcher'):
+            times[fields[2].strip()] = int(fields[1]) / 1e6
+    return times
+
+def main():
+    parser = ArgumentParser(description = 'Time the startup of peptide_matcher.')
+    parser.add_argument('--repeat', '-r', metavar = 'N', type = int, default = 10, help = 'number of repetitions (default: 10)')
+    parser.add_argument('--budget', metavar = 'SECONDS', type = float, default = 0.15, help = 'allowed startup time on top of the bare interpreter (default: 0.15)')
+    parser.add_argument('--label', help = 'name of the run stored with the results')
+    parser.add_argument('--output', '-o', default = '-', help = 'JSON file for the results (default: stdout)')
+    args = parser.parse_args()
+
+    times = { case: [ time_case(code) for i in range(args.repeat) ] for case, code in CASES.items() }
+    stages = { case: min(values) for case, values in times.items() }
+    failures = []
+    for case in BUDGET_CASES:
+        overhead = stages[case] - stages['interpreter']
+        if overhead > args.budget:
+            failures.append('%s takes %.3f s over the interpreter, more than the budget of %.3f s' % (case, overhead, args.budget))
+        loaded = loaded_modules(CASES[case])
+        if loaded:
+            failures.append('%s loads %s' % (case, ', '.join(loaded)))
+
+    results = {
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': { 'repeat': args.repeat, 'budget': args.budget },
+        'counts': {},
+        'stages': stages,
+        'runs': times,
+        'modules': import_times(CASES['import_matcher']),
+        'failures': failures
+    }
+    out = open(args.output, 'w') if args.output != '-' else sys.stdout
+    json.dump(results, out, indent = 2)
+    out.write('\n')
+    if out is not sys.stdout:
+        out.close()
+    for failure in failures:
+        print(failure, file = sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,22 @@
-from .peptideMatcher import PeptideMatcher, wrap_logos, wrap_scores
-from .pmFrame        import PMFrame
+import importlib
+
+# the names of the package are imported on first use, so that neither the
+# library nor the CLI load wx or other modules they do not need
+_modules = {
+    'PeptideMatcher': 'peptideMatcher',
+    'wrap_logos':     'peptideMatcher',
+    'wrap_scores':    'peptideMatcher',
+    'PMFrame':        'pmFrame'
+}
+
+__all__ = list(_modules)
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    value = getattr(importlib.import_module('.' + _modules[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_modules))
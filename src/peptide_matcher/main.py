@@ -1,8 +1,11 @@
 
 def run_gui():
 
+    try:
+        import wx
+    except ModuleNotFoundError:
+        raise SystemExit('The GUI needs wxPython: pip install peptide_matcher[gui]')
     from peptide_matcher import PMFrame
-    import wx
 
     class PeptideMatcherApp(wx.App):
         def OnInit(self):
@@ -14,87 +17,162 @@ def run_gui():
     peptide_matcher = PeptideMatcherApp(0)
     peptide_matcher.MainLoop()
 
+def run_index(argv):
+
+    from peptide_matcher.pmDatabase import build_index, IndexedDatabase
+    from peptide_matcher.pmSuffix import write_suffix_array
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog = 'peptide_matcher index', description = 'Convert a protein database into the indexed binary format.')
+    parser.add_argument('--database', '-d', metavar = 'FILENAME', required = True, help = 'protein database in fasta format, optionally gzip, BGZF or zstd compressed')
+    parser.add_argument('--secstruct', '-s', action = 'store_true', help = 'whether the database also contains structural information')
+    parser.add_argument('--output', '-o', metavar = 'FILENAME', required = True, help = 'indexed database file to write')
+    parser.add_argument('--suffix-array', action = 'store_true', help = 'also build the suffix array used by `--engine suffix-array` (otherwise built on first use)')
+
+    args = parser.parse_args(argv)
+
+    build_index(args.database, args.output, args.secstruct)
+    if args.suffix_array:
+        database = IndexedDatabase(args.output)
+        try:
+            write_suffix_array(database)
+        finally:
+            database.close()
+
+def run_serve(argv):
+
+    from peptide_matcher.pmServer import check_socket_path, serve
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog = 'peptide_matcher serve', description = 'Keep protein databases loaded and match peptides sent over HTTP (POST /match, GET /metrics).')
+    parser.add_argument('--database', '-d', metavar = '[NAME=]FILENAME', action = 'append', required = True, help = 'protein database in fasta format or indexed with `peptide_matcher index`, can be repeated')
+    parser.add_argument('--secstruct', '-s', action = 'store_true', help = 'whether the fasta databases also contain structural information')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type = int, default = 8080, help = 'port to listen on (default: 8080)')
+    parser.add_argument('--socket', metavar = 'PATH', help = 'listen on a unix socket instead of a TCP port')
+    parser.add_argument('--automaton-cache', metavar = 'DIR', help = 'directory for caching compiled peptide automata')
+
+    args = parser.parse_args(argv)
+    if args.socket:
+        try:
+            check_socket_path(args.socket)
+        except AssertionError as e:
+            parser.error(str(e))
+
+    serve(args.database, args.secstruct, args.host, args.port, args.socket, args.automaton_cache)
+
 def run_cli():
 
-    from peptide_matcher import PeptideMatcher, wrap_logos, wrap_scores
+    from peptide_matcher import PeptideMatcher
+    from peptide_matcher.peptideMatcher import tsv_fields
+    from peptide_matcher.pmCompress import open_input
+    from peptide_matcher.pmStats import ProgressBar
+    from peptide_matcher.pmWriters import FORMATS, WRITERS, open_writer, write_table
     from argparse import ArgumentParser
     from sys import argv
     import json
-    import csv
-    import sys
+    import os
+
+    if len(argv) > 1 and argv[1] == 'index':
+        return run_index(argv[2:])
+    if len(argv) > 1 and argv[1] == 'serve':
+        return run_serve(argv[2:])
 
     parser = ArgumentParser(description = 'Match peptides in a protein database.')
-    parser.add_argument('--peptides', '-p', metavar = 'FILENAME', required = True, help = 'list of peptides to match')
-    parser.add_argument('--database', '-d', metavar = 'FILENAME', required = True, help = 'protein database in fasta format')
+    parser.add_argument('--peptides', '-p', metavar = 'FILENAME', nargs = '+', help = 'list(s) of peptides to match, each file is treated as a separate sample')
+    parser.add_argument('--manifest', '-m', metavar = 'FILENAME', help = 'file listing the peptide lists to match, one per line, optionally preceded by a sample name and a tab')
+    parser.add_argument('--database', '-d', metavar = 'FILENAME', required = True, help = 'protein database in fasta format, optionally gzip, BGZF or zstd compressed, or indexed with `peptide_matcher index`')
     parser.add_argument('--secstruct', '-s', action = 'store_true', help = 'whether the database also contains structural information')
     parser.add_argument('--flanks', '-f', metavar = 'N', type = int, default = 4, help = 'length of the flanks to report (default: 4)')
-    parser.add_argument('--format', '-F', default = 'json', choices = [ 'json', 'tsv', ], help = 'output format (default: json)')
-    parser.add_argument('--output', '-o', default = '-', help = 'output file (default: output to stdout)')
+    parser.add_argument('--format', '-F', default = 'json', choices = FORMATS, help = 'output format: a json array, newline-delimited json with one match per line, tab- or comma-separated rows or an xlsx workbook, which needs an --output file (default: json)')
+    parser.add_argument('--output', '-o', default = '-', help = 'output file, with several samples a {sample} placeholder in the name gives one file per sample, a .gz suffix compresses the output (default: output to stdout)')
+    parser.add_argument('--gzip', '-z', action = 'store_true', help = 'compress the output with gzip, on a background thread')
+    parser.add_argument('--jobs', '-j', metavar = 'N', type = int, default = 1, help = 'number of worker processes scanning the database (default: 1)')
+    parser.add_argument('--automaton-cache', metavar = 'DIR', help = 'directory for caching compiled peptide automata between runs')
+    parser.add_argument('--result-cache', metavar = 'DIR', help = 'directory for caching the hits of every peptide per database, so that later runs only scan for new peptides')
+    parser.add_argument('--equivalences', '-e', metavar = 'CLASSES', nargs = '?', const = 'IL', help = 'treat the residues within each of the comma-separated classes as equivalent, e.g. IL,QK,ND (default without CLASSES: IL)')
+    parser.add_argument('--max-mismatches', '-k', metavar = 'K', type = int, default = 0, help = 'also report hits with up to K substituted residues, K = 1 or 2 is practical (default: 0)')
+    parser.add_argument('--engine', default = 'automaton', choices = [ 'automaton', 'suffix-array', 'auto' ], help = 'search engine: an automaton of the peptides scanning the database, binary searches in a suffix array of the indexed database (built on first use), or a choice based on the number of peptide residues per database residue (default: automaton)')
+    parser.add_argument('--progress', action = 'store_true', help = 'show the progress of the database scan on stderr')
+    parser.add_argument('--stats', metavar = 'FILENAME', help = 'write the counters and stage timings of the run as json')
+    parser.add_argument('--coverage', metavar = 'FILENAME', help = 'also write the per-protein coverage by the matches, in the format told by the file name (.json, .ndjson, .csv, .xlsx, else tab-separated), with several samples per sample')
+    parser.add_argument('--stream', action = 'store_true', help = 'output the matches in database order as soon as they are found, without the logos')
+    parser.add_argument('--spill', action = 'store_true', help = 'keep the matches in a temporary file instead of memory until they are output')
 
     args = parser.parse_args()
 
-    out = open(args.output, 'w') if args.output != '-' else sys.stdout
-
-    if args.format == 'json':
-        top = '['
-        bottom = ']'
-    elif args.format == 'tsv' or args.format == 'csv':
-        delimiter = '\t' if args.format == 'tsv' else ','
-        header = [ 'peptide', 'peplen', 'record_id', 'start', 'end', 'c_term', 'n_flank', 'c_flank', 'n_logos', 'c_logos', 'sst_n_term', 'sst_pept', 'sst_c_term', 'tm_n_term', 'tm_pept', 'tm_c_term', 'conf_n_term', 'conf_pept', 'conf_c_term', 'acc_n_term', 'acc_pept', 'acc_c_term' ]
-        writer = csv.DictWriter(out, delimiter = delimiter, fieldnames = header)
-        writer.writeheader()
-        top = ''
-        bottom = ''
-    
-    with open(args.peptides) as peptides:
-        if top: out.write(top)
-        pm = PeptideMatcher(peptides, args.database, args.secstruct, args.flanks)
-        is_first = True
-        for output in pm.run():
-            if args.format == 'json':
-                json_str = json.dumps(output)
-                if not is_first: out.write(',')
-                out.write(json_str)
-            elif args.format == 'tsv' or args.format == 'csv':
-                if output['matches']:
-                    n_logos = wrap_logos(output['n_logos'])
-                    c_logos = wrap_logos(output['c_logos'])
-                    for match in output['matches']:
-                        row = {
-                            'peptide':   output['peptide'],
-                            'peplen':    len(output['peptide']),
-                            'record_id': match['record_id'],
-                            'start':     match['start'],
-                            'end':       match['end'],
-                            'c_term':    match['c_term'],
-                            'n_flank':   match['n_flank'],
-                            'c_flank':   match['c_flank'],
-                            'n_logos':   n_logos,
-                            'c_logos':   c_logos
-                        }
-                        if args.secstruct:
-                            row['sst_n_term']  = match['sst_n_term']
-                            row['sst_pept']    = match['sst_pept']
-                            row['sst_c_term']  = match['sst_c_term']
-                            row['tm_n_term']   = match['tm_n_term']
-                            row['tm_pept']     = match['tm_pept']
-                            row['tm_c_term']   = match['tm_c_term']
-                            row['conf_n_term'] = wrap_scores(match['conf_n_term'])
-                            row['conf_pept']   = wrap_scores(match['conf_pept'])
-                            row['conf_c_term'] = wrap_scores(match['conf_c_term'])
-                            row['acc_n_term']  = wrap_scores(match['acc_n_term'])
-                            row['acc_pept']    = wrap_scores(match['acc_pept'])
-                            row['acc_c_term']  = wrap_scores(match['acc_c_term'])
-                        writer.writerow(row)
-                else:
-                    row = {
-                        'peptide': output['peptide'],
-                        'peplen': len(output['peptide']),
-                        'record_id': 'No match'
-                    }
-                    writer.writerow(row)
-            is_first = False
-        if bottom: print(bottom)
-    if out is not sys.stdout:
-        out.close()
+    if not args.peptides and not args.manifest:
+        parser.error('either --peptides or --manifest is required')
+    if args.format == 'xlsx' and (args.output == '-' or args.gzip or args.output.endswith('.gz')):
+        parser.error('--format xlsx needs an uncompressed --output file')
+    if args.coverage and (args.stream or args.spill):
+        parser.error('--coverage cannot be combined with --stream or --spill')
+
+    sample_files = {}
+    def add_sample(sample, filename):
+        if not sample:
+            sample = os.path.splitext(os.path.basename(filename))[0]
+        assert sample not in sample_files, "Duplicate sample name '%s'" % sample
+        sample_files[sample] = filename
+    if args.manifest:
+        with open_input(args.manifest) as manifest:
+            for line in manifest:
+                fields = line.rstrip('\n').split('\t')
+                if not fields[-1]: continue
+                filename = os.path.join(os.path.dirname(args.manifest), fields[-1])
+                add_sample(fields[0] if len(fields) > 1 else None, filename)
+    for filename in args.peptides or []:
+        add_sample(None, filename)
+    multi_sample = args.manifest or len(sample_files) > 1
+    split_samples = multi_sample and '{sample}' in args.output
+
+    fields = tsv_fields(args.equivalences, args.max_mismatches)
+    if multi_sample and not split_samples:
+        fields = [ 'sample' ] + fields
+    writer_class = WRITERS.get(args.format)
+
+    # writers are opened on first use
+    writers = {}
+    def get_writer(sample):
+        key = sample if split_samples else None
+        if key not in writers:
+            filename = args.output.replace('{sample}', sample) if split_samples else args.output
+            writers[key] = open_writer(args.format, filename, fields, args.secstruct, args.gzip)
+        return writers[key]
 
+    peptide_files = { sample: open_input(filename) for sample, filename in sample_files.items() }
+    try:
+        peptides = peptide_files if multi_sample else next(iter(peptide_files.values()))
+        pm = PeptideMatcher(peptides, args.database, args.secstruct, args.flanks, args.jobs, args.automaton_cache, args.spill, args.equivalences, args.max_mismatches, args.engine, ProgressBar() if args.progress else None, args.result_cache)
+        if args.stream:
+            rows_per_sample = writer_class is None or writer_class.rows_per_sample
+            for match in pm.stream():
+                samples = match.get('samples', [ None ])
+                for sample in (samples if split_samples or rows_per_sample else samples[:1]):
+                    get_writer(sample).write_match(match, sample)
+        else:
+            for output in pm.run():
+                get_writer(output.get('sample')).write_output(output)
+        # every output is written, also for samples without any matches
+        for sample in sample_files if split_samples else list(sample_files)[:1]:
+            get_writer(sample)
+    finally:
+        for peptides in peptide_files.values():
+            peptides.close()
+    for writer in writers.values():
+        writer.close()
+    if args.coverage:
+        from peptide_matcher.pmCoverage import coverage_fields
+        fields = coverage_fields(args.secstruct)
+        if not multi_sample:
+            write_table(args.coverage, fields, pm.coverage())
+        elif '{sample}' in args.coverage:
+            for sample in sample_files:
+                write_table(args.coverage.replace('{sample}', sample), fields, pm.coverage(sample))
+        else:
+            rows = ({ 'sample': sample, **row } for sample in sample_files for row in pm.coverage(sample))
+            write_table(args.coverage, [ 'sample' ] + fields, rows)
+    if args.stats:
+        with open(args.stats, 'w') as out:
+            json.dump(pm.stats.as_dict(), out, indent = 2)
+            out.write('\n')
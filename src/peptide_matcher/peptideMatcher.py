@@ -1,176 +1,429 @@
-from Bio import SeqIO
+from peptide_matcher import pmDatabase, pmStats
+import os
 import re
-from collections import Counter, defaultdict
+import tempfile
+from collections import Counter
+from time import perf_counter
+from operator import ne
 from ahocorasick import Automaton
 
+peptide_re = re.compile('[ACDEFGHIKLMNPQRSTVWY]+$')
+
+ENGINES = [ 'automaton', 'suffix-array', 'auto' ]
+# with engine 'auto' the suffix array is used once the peptides hold at least
+# 1 / SUFFIX_ARRAY_RATIO residues per database residue
+SUFFIX_ARRAY_RATIO = 4
+
+# residue classes such as 'IL' or ['IL', 'QK'] (overlapping classes are merged)
+# as a str.translate table mapping every residue to its class representative
+def equivalence_table(classes):
+    if isinstance(classes, str):
+        classes = classes.split(',')
+    groups = []
+    for residues in classes:
+        residues = residues.strip().upper()
+        assert peptide_re.match(residues), "Malformed residue class '%s'" % residues
+        group = set(residues)
+        for other in [ other for other in groups if other & group ]:
+            group |= other
+            groups.remove(other)
+        groups.append(group)
+    return { ord(residue): min(group) for group in groups for residue in group }
+
+# scans the sequences in the reduced alphabet, positions are not affected
+class ReducedAutomaton:
+
+    def __init__(self, automaton, table):
+        self.automaton = automaton
+        self.table = table
+
+    def iter(self, text):
+        return self.automaton.iter(text.translate(self.table))
+
+# the K + 1 segments of a peptide as (segment, offset of its last residue);
+# a hit with at most K mismatches contains at least one segment unchanged
+def seeds(peptide, max_mismatches):
+    n = max_mismatches + 1
+    bounds = [ len(peptide) * i // n for i in range(n + 1) ]
+    return [ (peptide[bounds[i]:bounds[i + 1]], bounds[i + 1] - 1) for i in range(n) ]
+
+# finds the hits with at most max_mismatches substitutions: the automaton holds the
+# seeds of the peptides, every seed hit is extended to the full peptide window and
+# verified, hits are returned ordered by their end as with an exact automaton
+class SeedAutomaton:
+
+    def __init__(self, automaton, max_mismatches, table = None):
+        self.automaton = automaton
+        self.max_mismatches = max_mismatches
+        self.table = table
+
+    def iter(self, text):
+        if self.table:
+            text = text.translate(self.table)
+        seen = set()
+        hits = []
+        for end_index, keys in self.automaton.iter(text):
+            for key, seed_end in keys:
+                start = end_index - seed_end
+                end = start + len(key)
+                if start < 0 or end > len(text) or (start, key) in seen:
+                    continue
+                seen.add((start, key))
+                window = text[start:end]
+                # windows running over a record separator of an indexed database
+                if '\n' in window:
+                    continue
+                if sum(map(ne, window, key)) <= self.max_mismatches:
+                    hits.append((end - 1, key))
+        # by end and, as in the automaton, longer keys first; keys of equal length
+        # ending at the same position only differ with mismatches
+        hits.sort(key = lambda hit: (hit[0], -len(hit[1]), hit[1]))
+        return iter(hits)
+
 class PeptideMatcher:
 
-    def __init__(self, peptides, fasta, sst_included, flanks):
+    def __init__(self, peptides, fasta, sst_included, flanks, workers = 1, automaton_cache = None, spill = False, equivalences = None, max_mismatches = 0, engine = 'automaton', progress = None, result_cache = None):
         self.fasta = fasta
         self.sst_included = sst_included
         self.peptides = peptides
         self.flanks = flanks
+        self.workers = workers
+        # the caches (sqlite3, pickle) and the worker pool are only imported when used
+        if isinstance(automaton_cache, str):
+            from peptide_matcher import pmCache
+            automaton_cache = pmCache.AutomatonCache(automaton_cache)
+        self.automaton_cache = automaton_cache
+        self.spill = spill
+        self.equivalences = equivalence_table(equivalences) if equivalences else None
+        self.max_mismatches = max_mismatches
+        assert engine in ENGINES, "Unknown search engine '%s'" % engine
+        self.engine = engine
+        # called with the Stats of the run while the database is scanned
+        self.progress = progress
+        self.stats = pmStats.Stats(progress)
+        if isinstance(result_cache, str):
+            from peptide_matcher import pmCache
+            result_cache = pmCache.ResultCache(result_cache)
+        self.result_cache = result_cache
+        # the MatchTable of the last run, kept for the protein coverage
+        self.table = None
         self.flanks_range = list(range(flanks))
         self.flanks_revrange = list(reversed(range(flanks)))
-        self.sst_re  = re.compile('secstruct:([^\s]+)')
-        self.acc_re  = re.compile('accessibility:([^\s]+)')
-        self.conf_re = re.compile('confidence:([^\s]+)')
-        self.tm_re   = re.compile('transmembrane:([^\s]+)')
-        self.cigar_re = re.compile('(\d+)(.)')
+        self.sst_re  = pmDatabase.sst_re
+        self.acc_re  = pmDatabase.acc_re
+        self.conf_re = pmDatabase.conf_re
+        self.tm_re   = pmDatabase.tm_re
+        self.cigar_re = pmDatabase.cigar_re
 
+    # peptides is either one list or a dict of lists keyed by sample name
     def parse_peptides(self):
-        self.automaton = Automaton()
+        if isinstance(self.peptides, dict):
+            sources = list(self.peptides.items())
+        else:
+            sources = [ (None, self.peptides) ]
         self.peptide_seqs = []
-        for line in self.peptides:
-           peptide = line.rstrip().upper()
-           assert re.match('[ACDEFGHIKLMNPQRSTVWY]+$', peptide), "Malformed peptide string '%s'" % peptide
-           self.automaton.add_word(peptide, peptide)
-           self.peptide_seqs.append(peptide)
-        assert len(self.automaton) > 0, "The peptide list seems empty"
-        self.automaton.make_automaton()
+        self.sample_peptides = []
+        self.peptide_samples = {}
+        for sample, lines in sources:
+            n_peptides = len(self.peptide_seqs)
+            for line in lines:
+               peptide = line.rstrip().upper()
+               assert peptide_re.match(peptide), "Malformed peptide string '%s'" % peptide
+               self.peptide_seqs.append(peptide)
+               self.sample_peptides.append((sample, peptide))
+               samples = self.peptide_samples.setdefault(peptide, [])
+               if sample is not None and sample not in samples:
+                   samples.append(sample)
+            assert sample is None or len(self.peptide_seqs) > n_peptides, "The peptide list of sample '%s' seems empty" % sample
+        assert len(self.peptide_seqs) > 0, "The peptide list seems empty"
+        if self.equivalences:
+            # one automaton entry per reduced peptide, hits are reported for all its variants
+            self.variants = {}
+            for peptide in dict.fromkeys(self.peptide_seqs):
+                self.variants.setdefault(peptide.translate(self.equivalences), []).append(peptide)
+            self.keys = list(self.variants)
+        else:
+            self.variants = None
+            self.keys = list(dict.fromkeys(self.peptide_seqs))
+        if self.max_mismatches:
+            assert self.max_mismatches > 0, "The number of mismatches cannot be negative"
+            for key in self.keys:
+                assert len(key) > self.max_mismatches, "Peptide '%s' is too short for %d mismatches" % (key, self.max_mismatches)
+        self.automaton = None
 
-    def hexpairs(self, s, regex):
-        match = regex.search(s)
-        if match:
-            line = match.group(1)
-            return [ int(line[i:i+2], 16) for i in range(0, len(line), 2) ]
+    # the automaton is only compiled once the automaton engine has been selected
+    def make_automaton(self):
+        if self.max_mismatches:
+            seed_keys = {}
+            for key in self.keys:
+                for seed, seed_end in seeds(key, self.max_mismatches):
+                    seed_keys.setdefault(seed, []).append((key, seed_end))
+            self.automaton = SeedAutomaton(self.build_automaton(seed_keys, seed_keys), self.max_mismatches, self.equivalences)
+        elif self.equivalences:
+            self.automaton = ReducedAutomaton(self.build_automaton(self.keys), self.equivalences)
         else:
-            return []
+            self.automaton = self.build_automaton(self.keys)
+        return self.automaton
+
+    # values maps the words to the values stored in the automaton (default: the words)
+    def build_automaton(self, words, values = None):
+        if self.automaton_cache:
+            from peptide_matcher import pmCache
+            key = pmCache.digest(words, values)
+            automaton = self.automaton_cache.get(key)
+            if automaton is not None:
+                return automaton
+        automaton = Automaton()
+        for word in words:
+            automaton.add_word(word, values[word] if values else word)
+        automaton.make_automaton()
+        if self.automaton_cache:
+            self.automaton_cache.put(key, automaton)
+        return automaton
+
+    def hexpairs(self, s, regex):
+        return list(pmDatabase.hexpairs(s, regex))
 
     def decompress(self, s, regex):
-        s2 = ''
-        match = regex.search(s)
-        if match:
-            line = match.group(1)
-            for num, char in self.cigar_re.findall(line):
-                s2 += char * int(num)
-        return s2
+        return pmDatabase.decompress(s, regex).decode('ascii')
 
-    def run(self):
-        self.parse_peptides()
-        data = defaultdict(list)
-        for record in SeqIO.parse(self.fasta, 'fasta'):
-            record_seq = str(record.seq)
-            seq_len = len(record_seq)
-            if self.sst_included:
-                sst  = self.decompress(record.description, self.sst_re)
-                tm   = self.decompress(record.description, self.tm_re)
-                acc  = self.hexpairs(record.description, self.acc_re)
-                conf = self.hexpairs(record.description, self.conf_re)
+    def windows(self, track, start_index, end, n_open, c_open):
+        n_term = track[max(start_index - self.flanks, 0):start_index]
+        c_term = track[end:] if c_open else track[end:end + self.flanks]
+        return n_term, track[start_index:end], c_term
+
+    def seq_windows(self, seq, start_index, end, n_open, c_open):
+        n_term, pept, c_term = self.windows(seq, start_index, end, n_open, c_open)
+        return ('[' if n_open else '') + n_term, pept, c_term + (']' if c_open else '')
+
+    def str_windows(self, track, start_index, end, n_open, c_open):
+        if not track:
+            return '', '', ''
+        n_term, pept, c_term = self.windows(track, start_index, end, n_open, c_open)
+        return ('[' if n_open else '') + str(n_term, 'ascii'), str(pept, 'ascii'), str(c_term, 'ascii') + (']' if c_open else '')
+
+    def score_windows(self, track, start_index, end, n_open, c_open):
+        if not track:
+            return [], [], []
+        n_term, pept, c_term = self.windows(track, start_index, end, n_open, c_open)
+        n_term = [ '[' ] + list(n_term) if n_open else list(n_term)
+        c_term = list(c_term) + [ ']' ] if c_open else list(c_term)
+        return n_term, list(pept), c_term
+
+    def match(self, record, start_index, end, peptide = None):
+        to_c_term = len(record.seq) - end
+        n_open = start_index <= self.flanks
+        c_open = to_c_term <= self.flanks
+        n_term, pept, c_term = self.seq_windows(record.seq, start_index, end, n_open, c_open)
+        match = {
+            'record_id': record.id,
+            'start': start_index + 1,
+            'end': end,
+            'c_term': to_c_term + 1,
+            'n_flank': n_term
+        }
+        # the peptide span as it reads in the database
+        if self.equivalences or self.max_mismatches:
+            match['db_pept'] = pept
+        match['c_flank'] = c_term
+        if self.max_mismatches:
+            query, subject = peptide, pept
+            if self.equivalences:
+                query, subject = query.translate(self.equivalences), subject.translate(self.equivalences)
+            positions = [ i + 1 for i, (a, b) in enumerate(zip(query, subject)) if a != b ]
+            match['mismatches'] = len(positions)
+            match['mismatch_positions'] = positions
+        if self.sst_included:
+            tracks = self.record_tracks(record)
+            match['sst_n_term'], match['sst_pept'], match['sst_c_term'] = self.str_windows(tracks['sst'], start_index, end, n_open, c_open)
+            match['tm_n_term'], match['tm_pept'], match['tm_c_term'] = self.str_windows(tracks['tm'], start_index, end, n_open, c_open)
+            match['conf_n_term'], match['conf_pept'], match['conf_c_term'] = self.score_windows(tracks['conf'], start_index, end, n_open, c_open)
+            match['acc_n_term'], match['acc_pept'], match['acc_c_term'] = self.score_windows(tracks['acc'], start_index, end, n_open, c_open)
+        return match
+
+    # the structural tracks of a record, their decoding is timed in the stats
+    def record_tracks(self, record):
+        if record._tracks is not None:
+            return record._tracks
+        time_start = perf_counter()
+        tracks = record.tracks
+        self.stats.add_time('decode', perf_counter() - time_start)
+        return tracks
+
+    def count_logos(self, peptide, seq, start_index, end):
+        if peptide not in self.logo_counts:
+            self.logo_counts[peptide] = [ Counter() for i in self.flanks_range ], [ Counter() for i in self.flanks_range ]
+        all_n_terms, all_c_terms = self.logo_counts[peptide]
+        for i in self.flanks_revrange:
+            pos = start_index - self.flanks + i
+            let = seq[pos] if pos >= 0 else '['
+            all_n_terms[i][let] += 1
+            if pos < 0: break
+        for i in self.flanks_range:
+            pos = end + i
+            let = seq[pos] if pos < len(seq) else ']'
+            all_c_terms[i][let] += 1
+            if pos >= len(seq): break
+
+    def logos(self, peptide):
+        if peptide not in self.logo_counts:
+            return [], []
+        all_n_terms, all_c_terms = self.logo_counts[peptide]
+        return [ dict(pos) for pos in all_n_terms ], [ dict(pos) for pos in all_c_terms ]
+
+    def select_engine(self, database):
+        if self.engine != 'auto':
+            return self.engine
+        if self.equivalences or self.max_mismatches or not isinstance(database, pmDatabase.IndexedDatabase):
+            return 'automaton'
+        from peptide_matcher import pmSuffix
+        if os.path.exists(pmSuffix.sa_path(database)):
+            return 'suffix-array'
+        residues = sum(len(key) for key in self.keys)
+        return 'suffix-array' if residues * SUFFIX_ARRAY_RATIO >= len(database.blobs['seq']) else 'automaton'
+
+    # (record, end_index, key) in database order from the selected search engine
+    def search(self, database):
+        if self.select_engine(database) == 'automaton':
+            if self.workers > 1:
+                from peptide_matcher import pmParallel
+                yield from pmParallel.scan(database, self.make_automaton(), self.workers, self.stats)
             else:
-                sst = tm = acc = conf = None
-            for end_index, peptide in self.automaton.iter(record_seq):
-                start_index = end_index - len(peptide) + 1
-                start = start_index + 1
-                end = end_index + 1
-                to_c_term = seq_len - end
-                if start_index > self.flanks:
-                    n_term = record_seq[start_index - self.flanks:start_index]
-                else:
-                    n_term = '[' + record_seq[0:start_index]
-                if to_c_term > self.flanks:
-                    c_term = record_seq[end:end + self.flanks]
-                else:
-                    c_term = record_seq[end:] + ']'
-
-                if sst:
-                    sst_pept = sst[start_index:end]
-                    if start_index > self.flanks:
-                        sst_n_term = sst[start_index - self.flanks:start_index]
-                    else:
-                        sst_n_term = '[' + sst[0:start_index]
-                    if to_c_term > self.flanks:
-                        sst_c_term = sst[end:end + self.flanks]
-                    else:
-                        sst_c_term = sst[end:] + ']'
-                else:
-                    sst_pept = sst_n_term = sst_c_term = ''
-
-                if tm:
-                    tm_pept = tm[start_index:end]
-                    if start_index > self.flanks:
-                        tm_n_term = tm[start_index - self.flanks:start_index]
-                    else:
-                        tm_n_term = '[' + tm[0:start_index]
-                    if to_c_term > self.flanks:
-                        tm_c_term = tm[end:end + self.flanks]
-                    else:
-                        tm_c_term = tm[end:] + ']'
-                else:
-                    tm_pept = tm_n_term = tm_c_term = ''
-
-                if acc:
-                    acc_pept = acc[start_index:end]
-                    if start_index > self.flanks:
-                        acc_n_term = acc[start_index - self.flanks:start_index]
-                    else:
-                        acc_n_term = [ '[' ] + acc[0:start_index]
-                    if to_c_term > self.flanks:
-                        acc_c_term = acc[end:end + self.flanks]
-                    else:
-                        acc_c_term = acc[end:] + [ ']' ]
-                else:
-                    acc_pept = acc_n_term = acc_c_term = []
-                if conf:
-                    conf_pept = conf[start_index:end]
-                    if start_index > self.flanks:
-                        conf_n_term = conf[start_index - self.flanks:start_index]
-                    else:
-                        conf_n_term = [ '[' ] + conf[0:start_index]
-                    if to_c_term > self.flanks:
-                        conf_c_term = conf[end:end + self.flanks]
-                    else:
-                        conf_c_term = conf[end:] + [ ']' ]
-                else:
-                    conf_pept = conf_n_term = conf_c_term = []
-                data[peptide].append((record.id, start, end, n_term, c_term, to_c_term, sst_n_term, sst_pept, sst_c_term, tm_n_term, tm_pept, tm_c_term, conf_n_term, conf_pept, conf_c_term, acc_n_term, acc_pept, acc_c_term))
-        for peptide in self.peptide_seqs:
-            peplen = len(peptide)
-            matches = []
-            n_logos = []
-            c_logos = []
-            if peptide in data:
-                all_n_terms = []
-                all_c_terms = []
-                for i in range(self.flanks):
-                    all_n_terms.append([])
-                    all_c_terms.append([])
-                data_peptide = data[peptide]
-                for record_id, start, end, n_term, c_term, to_c_term, *struct_info in data_peptide:
-
-                    offset = self.flanks - len(n_term)
-
-                    for i in self.flanks_revrange:
-                        let = n_term[i - offset]
-                        all_n_terms[i].append(let)
-                        if let == '[': break
-                    for i in self.flanks_range:
-                        let = c_term[i]
-                        all_c_terms[i].append(let)
-                        if let == ']': break
-                    match = {
-                        'record_id': record_id,
-                        'start': start,
-                        'end': end,
-                        'c_term': to_c_term + 1,
-                        'n_flank': str(n_term),
-                        'c_flank': str(c_term)
-                    }
-                    if self.sst_included:
-                        match['sst_n_term'], match['sst_pept'], match['sst_c_term'], match['tm_n_term'], match['tm_pept'], \
-                        match['tm_c_term'], match['conf_n_term'], match['conf_pept'], match['conf_c_term'], match['acc_n_term'], match['acc_pept'], match['acc_c_term'] \
-                            = struct_info
-                    matches.append(match)
-
-                for pos in all_n_terms:
-                    logo = dict(Counter(pos))
-                    n_logos.append(logo)
-
-                for pos in all_c_terms:
-                    logo = dict(Counter(pos))
-                    c_logos.append(logo)
-
-            yield { 'peptide': peptide, 'matches': matches, 'n_logos': n_logos, 'c_logos': c_logos }
+                yield from database.scan(self.make_automaton(), stats = self.stats)
+            return
+        assert not self.equivalences and not self.max_mismatches, "The suffix-array engine only supports exact matching"
+        from peptide_matcher import pmSuffix
+        if isinstance(database, pmDatabase.IndexedDatabase):
+            suffix_array = pmSuffix.open_suffix_array(database)
+            try:
+                yield from suffix_array.scan(self.keys, self.stats)
+            finally:
+                suffix_array.close()
+            return
+        # fasta databases are indexed first, the suffix array is then not kept
+        with tempfile.TemporaryDirectory(prefix = 'peptide_matcher') as workdir:
+            path = os.path.join(workdir, 'database.pmdb')
+            time_start = perf_counter()
+            pmDatabase.build_index(database.fasta, path, self.sst_included)
+            self.stats.add_time('parse', perf_counter() - time_start)
+            indexed = pmDatabase.IndexedDatabase(path, self.sst_included)
+            try:
+                yield from self.search(indexed)
+            finally:
+                indexed.close()
+            database.records_scanned = indexed.records_scanned
+
+    # the search parameters the hits of a key depend on, part of the result cache key
+    def search_params(self):
+        return repr((sorted(self.equivalences.items()) if self.equivalences else None, self.max_mismatches))
+
+    # search() for the keys without cached hits, merged with the cached hits in
+    # database order; the hits found are added to the cache
+    def cached_search(self, database, digest):
+        params = self.search_params()
+        cached = self.result_cache.get(digest, params, self.keys)
+        self.stats.cached = len(cached)
+        hits = [ (record_index, end_index, key) for key, key_hits in cached.items() for record_index, end_index in key_hits ]
+        missing = [ key for key in self.keys if key not in cached ]
+        if missing:
+            found = { key: [] for key in missing }
+            keys = self.keys
+            self.keys = missing
+            try:
+                for record, end_index, key in self.search(database):
+                    found[key].append((record.index, end_index))
+                    hits.append((record.index, end_index, key))
+            finally:
+                self.keys = keys
+            self.result_cache.put(digest, params, found)
+        # the order of a scan: by record and end, longer keys first
+        hits.sort(key = lambda hit: (hit[0], hit[1], -len(hit[2]), hit[2]))
+        record = None
+        for record_index, end_index, key in hits:
+            if record is None or record.index != record_index:
+                record = database.record(record_index)
+            yield record, end_index, key
+
+    # hits in database order as (peptide, record, start_index, end), logos are counted on the way
+    def scan(self, count_logos = True):
+        self.parse_peptides()
+        self.logo_counts = {}
+        stats = self.stats = pmStats.Stats(self.progress)
+        if self.result_cache is not None and isinstance(self.fasta, str):
+            time_start = perf_counter()
+            digest, database = self.result_cache.open_database(self.fasta, self.sst_included)
+            stats.add_time('parse', perf_counter() - time_start)
+            hits = self.cached_search(database, digest)
+        else:
+            database = pmDatabase.open_database(self.fasta, self.sst_included)
+            hits = self.search(database)
+        stats.bytes_total = database.size()
+        for record, end_index, key in hits:
+            start_index = end_index - len(key) + 1
+            end = end_index + 1
+            for peptide in self.variants[key] if self.variants else (key,):
+                stats.hits += 1
+                if count_logos:
+                    self.count_logos(peptide, record.seq, start_index, end)
+                yield peptide, record, start_index, end
+        stats.set_stage('aggregate')
+
+    def stream(self):
+        for peptide, record, start_index, end in self.scan():
+            match = { 'peptide': peptide }
+            if self.peptide_samples[peptide]:
+                match['samples'] = self.peptide_samples[peptide]
+            match.update(self.match(record, start_index, end, peptide))
+            yield match
+        self.stats.set_stage('done')
+
+    def match_table(self):
+        from peptide_matcher import pmTable
+        table = pmTable.MatchTable(self)
+        for hit in self.scan(count_logos = False):
+            table.add(*hit)
+        table.finish()
+        self.table = table
+        self.stats.set_stage('done')
+        return table
+
+    def run(self):
+        from peptide_matcher import pmStore, pmTable
+        if self.spill:
+            store = pmStore.SpillStore(self, self.spill)
+            logos = self.logos
+        else:
+            store = self.table = pmTable.MatchTable(self)
+            logos = None
+        try:
+            aggregate = 0.0
+            for hit in self.scan(count_logos = logos is not None):
+                time_start = perf_counter()
+                store.add(*hit)
+                aggregate += perf_counter() - time_start
+            self.stats.add_time('aggregate', aggregate)
+            time_start = perf_counter()
+            if logos is None:
+                logos = store.logos().logos
+            self.stats.add_time('aggregate', perf_counter() - time_start)
+            for sample, peptide in self.sample_peptides:
+                time_start = perf_counter()
+                n_logos, c_logos = logos(peptide)
+                output = { 'peptide': peptide, 'matches': store.matches(peptide), 'n_logos': n_logos, 'c_logos': c_logos }
+                if sample is not None:
+                    output = dict(sample = sample, **output)
+                self.stats.add_time('aggregate', perf_counter() - time_start)
+                yield output
+            self.stats.set_stage('done')
+        finally:
+            store.close()
+
+    # rows of the per-protein coverage by the matches of the last run() or
+    # match_table(), by the peptides of one sample if given
+    def coverage(self, sample = None):
+        assert self.table is not None, 'The protein coverage needs a completed run() without spill or match_table()'
+        peptides = None if sample is None else [ peptide for peptide_sample, peptide in self.sample_peptides if peptide_sample == sample ]
+        return self.table.coverage(peptides).rows()
 
 def wrap_logos(logos):
     logo_strs = []
@@ -181,3 +434,61 @@ def wrap_logos(logos):
 
 def wrap_scores(scores):
     return ','.join(map(str, scores))
+
+tsv_header = [ 'peptide', 'peplen', 'record_id', 'start', 'end', 'c_term', 'n_flank', 'c_flank', 'n_logos', 'c_logos', 'sst_n_term', 'sst_pept', 'sst_c_term', 'tm_n_term', 'tm_pept', 'tm_c_term', 'conf_n_term', 'conf_pept', 'conf_c_term', 'acc_n_term', 'acc_pept', 'acc_c_term' ]
+
+# with residue equivalences or mismatches the matched database residues go next to
+# the flanks, followed by the mismatches after the c-flank
+def tsv_fields(equivalences, max_mismatches = 0):
+    if not equivalences and not max_mismatches:
+        return tsv_header
+    i = tsv_header.index('c_flank')
+    mismatches = [ 'mismatches', 'mismatch_positions' ] if max_mismatches else []
+    return tsv_header[:i] + [ 'db_pept', 'c_flank' ] + mismatches + tsv_header[i + 1:]
+
+def match_row(peptide, match, n_logos, c_logos, sst_included):
+    row = {
+        'peptide':   peptide,
+        'peplen':    len(peptide),
+        'record_id': match['record_id'],
+        'start':     match['start'],
+        'end':       match['end'],
+        'c_term':    match['c_term'],
+        'n_flank':   match['n_flank'],
+        'c_flank':   match['c_flank'],
+        'n_logos':   n_logos,
+        'c_logos':   c_logos
+    }
+    if 'db_pept' in match:
+        row['db_pept'] = match['db_pept']
+    if 'mismatches' in match:
+        row['mismatches'] = match['mismatches']
+        row['mismatch_positions'] = wrap_scores(match['mismatch_positions'])
+    if sst_included:
+        row['sst_n_term']  = match['sst_n_term']
+        row['sst_pept']    = match['sst_pept']
+        row['sst_c_term']  = match['sst_c_term']
+        row['tm_n_term']   = match['tm_n_term']
+        row['tm_pept']     = match['tm_pept']
+        row['tm_c_term']   = match['tm_c_term']
+        row['conf_n_term'] = wrap_scores(match['conf_n_term'])
+        row['conf_pept']   = wrap_scores(match['conf_pept'])
+        row['conf_c_term'] = wrap_scores(match['conf_c_term'])
+        row['acc_n_term']  = wrap_scores(match['acc_n_term'])
+        row['acc_pept']    = wrap_scores(match['acc_pept'])
+        row['acc_c_term']  = wrap_scores(match['acc_c_term'])
+    return row
+
+# the tabular rows of one run() output, a 'No match' row for peptides without matches
+def output_rows(output, sst_included):
+    if output['matches']:
+        n_logos = wrap_logos(output['n_logos'])
+        c_logos = wrap_logos(output['c_logos'])
+        for match in output['matches']:
+            yield match_row(output['peptide'], match, n_logos, c_logos, sst_included)
+    else:
+        yield {
+            'peptide': output['peptide'],
+            'peplen': len(output['peptide']),
+            'record_id': 'No match'
+        }
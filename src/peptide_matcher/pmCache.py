@@ -0,0 +1,175 @@
+from peptide_matcher import pmDatabase
+from array import array
+import ahocorasick
+import hashlib
+import os
+import pickle
+import sqlite3
+
+MAX_SIZE = 1 << 30
+CHUNK_SIZE = 1 << 20
+# keys per lookup, below the limit of sqlite on query parameters
+QUERY_KEYS = 500
+
+# values, if any, are the values stored for the words and are part of the key
+def digest(words, values = None):
+    h = hashlib.sha256()
+    for word in sorted(words):
+        h.update(word.encode('utf-8'))
+        if values:
+            h.update(b'\t' + repr(values[word]).encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+class AutomatonCache:
+
+    suffix = '.automaton'
+
+    def __init__(self, directory, max_size = MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            automaton = ahocorasick.load(path, pickle.loads)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return automaton
+
+    def put(self, key, automaton):
+        fd, tmp_path = pmDatabase.temp_file(self.directory)
+        os.close(fd)
+        try:
+            automaton.save(tmp_path, pickle.dumps)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    # drop the least recently used automata until the cache fits into max_size
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_size: break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+# Hits of every peptide (the search key, i.e. the reduced peptide with residue
+# equivalences) per database and search parameters, kept in a sqlite file in
+# directory. Hits are stored as raw coordinates, pairs of record index and end
+# index, from which matches, flanks and logos are computed again; they do not
+# depend on the flanks or the structural annotations. Databases are identified
+# by the digest of their content, which is computed again whenever the size or
+# mtime of the file changes, and the hits of a previous content are dropped.
+# Fasta databases are indexed into the directory, so that the records with
+# cached hits can be read without parsing the whole database.
+class ResultCache:
+
+    filename = 'results.sqlite'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        path = os.path.join(directory, self.filename)
+        # sqlite creates new files as 0644 masked by the umask, which never lets the
+        # group write; an empty file created here is a valid database with the mode
+        # of any new file, so other users of a shared cache can write to it too
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+        except FileExistsError:
+            pass
+        self.db = sqlite3.connect(path, timeout = 60)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS databases (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS hits (digest TEXT, params TEXT, key TEXT, hits BLOB, PRIMARY KEY (digest, params, key))')
+
+    # content digest of a database file, recomputed only when the file changed
+    def database_digest(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        row = self.db.execute('SELECT size, mtime, digest FROM databases WHERE path = ?', (path,)).fetchone()
+        if row and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return row[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO databases VALUES (?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns, digest))
+            if row and row[2] != digest:
+                self.drop(row[2])
+        return digest
+
+    # hits and indexed copies of a database content no longer referred to by any path
+    def drop(self, digest):
+        if self.db.execute('SELECT 1 FROM databases WHERE digest = ?', (digest,)).fetchone():
+            return
+        self.db.execute('DELETE FROM hits WHERE digest = ?', (digest,))
+        for sst_included in (False, True):
+            try:
+                os.unlink(self.index_path(digest, sst_included))
+            except OSError:
+                pass
+
+    def index_path(self, digest, sst_included):
+        return os.path.join(self.directory, digest + ('.sst' if sst_included else '') + '.pmdb')
+
+    # the database of a path with its digest, fasta databases as indexed copies
+    def open_database(self, path, sst_included):
+        digest = self.database_digest(path)
+        if pmDatabase.is_indexed(path):
+            return digest, pmDatabase.IndexedDatabase(path, sst_included)
+        index_path = self.index_path(digest, sst_included)
+        if not os.path.exists(index_path):
+            fd, tmp_path = pmDatabase.temp_file(self.directory)
+            os.close(fd)
+            try:
+                pmDatabase.build_index(path, tmp_path, sst_included)
+                os.replace(tmp_path, index_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return digest, pmDatabase.IndexedDatabase(index_path, sst_included)
+
+    # { key: [ (record index, end index), ... ] } for the cached keys
+    def get(self, digest, params, keys):
+        cached = {}
+        keys = list(keys)
+        for i in range(0, len(keys), QUERY_KEYS):
+            batch = keys[i:i + QUERY_KEYS]
+            cursor = self.db.execute('SELECT key, hits FROM hits WHERE digest = ? AND params = ? AND key IN (%s)' % ','.join('?' * len(batch)), [ digest, params ] + batch)
+            for key, hits in cursor:
+                hits = array('q', hits)
+                cached[key] = list(zip(hits[::2], hits[1::2]))
+        return cached
+
+    def put(self, digest, params, key_hits):
+        rows = []
+        for key, hits in key_hits.items():
+            values = array('q')
+            for record_index, end_index in hits:
+                values.append(record_index)
+                values.append(end_index)
+            rows.append((digest, params, key, values.tobytes()))
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?)', rows)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,159 @@
+from collections import deque
+import io
+import os
+import struct
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# gzip header with the extra field: the 'BC' subfield of BGZF holds the block size
+BGZF_HEADER = struct.Struct('<4sI2sH2sHH')
+GZIP_TRAILER = struct.Struct('<II')
+FEXTRA = 4
+CHUNK_SIZE = 1 << 20
+THREADS = min(4, os.cpu_count() or 1)
+# decompressed blocks kept in flight per thread
+BLOCKS_PER_THREAD = 8
+# chunks read ahead of the consumer for gzip and zstd streams
+READ_AHEAD = 4
+
+# 'gzip', 'bgzf', 'zstd' or None for uncompressed files
+def detect(path):
+    try:
+        with open(path, 'rb') as fh:
+            head = fh.read(BGZF_HEADER.size)
+    except (TypeError, OSError):
+        return None
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    if not head.startswith(GZIP_MAGIC):
+        return None
+    if len(head) == BGZF_HEADER.size and head[3] & FEXTRA and head[12:14] == b'BC':
+        return 'bgzf'
+    return 'gzip'
+
+# Binary stream over an iterator of (decompressed chunk, compressed bytes read),
+# closing fileobj with the stream. compressed_read is the position in the
+# compressed file of the data consumed so far.
+class ChunkReader(io.RawIOBase):
+
+    def __init__(self, chunks, fileobj):
+        self.chunks = chunks
+        self.fileobj = fileobj
+        self.chunk = memoryview(b'')
+        self.compressed_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not len(self.chunk):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            data, self.compressed_read = chunk
+            self.chunk = memoryview(data)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.chunks.close()
+            self.fileobj.close()
+        super().close()
+
+# the compressed blocks of a BGZF file with the file position after each block
+def bgzf_blocks(fileobj):
+    pos = 0
+    while True:
+        header = fileobj.read(BGZF_HEADER.size)
+        if not header:
+            return
+        assert len(header) == BGZF_HEADER.size, 'Truncated BGZF block at byte %d' % pos
+        magic, mtime, xfl_os, xlen, subfield, slen, bsize = BGZF_HEADER.unpack(header)
+        assert magic[:2] == GZIP_MAGIC and magic[3] & FEXTRA and subfield == b'BC' and slen == 2, 'Invalid BGZF block at byte %d' % pos
+        block = fileobj.read(bsize + 1 - BGZF_HEADER.size)
+        assert len(block) == bsize + 1 - BGZF_HEADER.size, 'Truncated BGZF block at byte %d' % pos
+        pos += bsize + 1
+        # deflate data after the remaining extra subfields, followed by crc32 and size
+        yield block[xlen - 6:-GZIP_TRAILER.size], block[-GZIP_TRAILER.size:], pos
+
+def inflate_block(data, trailer):
+    crc, size = GZIP_TRAILER.unpack(trailer)
+    out = zlib.decompress(data, -zlib.MAX_WBITS)
+    assert len(out) == size and zlib.crc32(out) == crc, 'Corrupt BGZF block'
+    return out
+
+# BGZF blocks are independent deflate streams: they are inflated on a thread pool
+# (zlib releases the GIL) while the consumer works on the blocks before them
+def bgzf_chunks(fileobj, threads):
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(threads) as pool:
+        pending = deque()
+        for data, trailer, pos in bgzf_blocks(fileobj):
+            pending.append((pool.submit(inflate_block, data, trailer), pos))
+            if len(pending) >= threads * BLOCKS_PER_THREAD:
+                future, pos_done = pending.popleft()
+                yield future.result(), pos_done
+        while pending:
+            future, pos_done = pending.popleft()
+            yield future.result(), pos_done
+
+# chunks of a sequential decompressor read on a background thread, ahead of the consumer
+def read_ahead(reader, fileobj):
+    from concurrent.futures import ThreadPoolExecutor
+    def read():
+        return reader.read(CHUNK_SIZE), fileobj.tell()
+    with ThreadPoolExecutor(1) as pool:
+        pending = deque(pool.submit(read) for i in range(READ_AHEAD))
+        while True:
+            data, pos = pending.popleft().result()
+            if not data:
+                break
+            pending.append(pool.submit(read))
+            yield data, pos
+
+def zstd_reader(fileobj, path):
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(fileobj)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading the zstd compressed '%s' needs the zstandard package" % path)
+    return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+# A text stream of a plain, gzip, BGZF or zstd compressed file, the compression
+# is told by the magic bytes. The thread pool and decompressors are imported for
+# compressed files only, plain files open without them. Compressed files are
+# decompressed on background threads as they are read: BGZF blocks in parallel,
+# other streams one chunk ahead.
+def open_input(path, threads = THREADS):
+    compression = detect(path)
+    if compression is None:
+        return open(path)
+    fileobj = open(path, 'rb')
+    if compression == 'bgzf':
+        chunks = bgzf_chunks(fileobj, threads)
+    elif compression == 'gzip':
+        import gzip
+        chunks = read_ahead(gzip.GzipFile(fileobj = fileobj), fileobj)
+    else:
+        try:
+            chunks = read_ahead(zstd_reader(fileobj, path), fileobj)
+        except ImportError:
+            fileobj.close()
+            raise
+    return io.TextIOWrapper(io.BufferedReader(ChunkReader(chunks, fileobj), CHUNK_SIZE))
+
+# bytes of the file behind a stream of open_input() read so far, compressed ones
+# for compressed files
+def bytes_read(handle):
+    raw = handle.buffer.raw
+    if isinstance(raw, ChunkReader):
+        return raw.compressed_read
+    return handle.buffer.tell()
@@ -0,0 +1,104 @@
+import numpy as np
+
+# structural classes of the residues: secondary structure letters of helices and
+# strands, transmembrane residues (any letter but '-') and exposed residues by
+# relative accessibility in percent
+HELIX = b'HGI'
+STRAND = b'EB'
+NO_TM = b'-'
+EXPOSED_ACC = 25
+
+COVERAGE_FIELDS = [ 'record_id', 'length', 'peptides', 'unique_peptides', 'shared_peptides', 'hits', 'covered', 'unique_covered', 'coverage' ]
+STRUCT_CLASSES = [ 'helix', 'strand', 'membrane', 'exposed' ]
+STRUCT_FIELDS = [ field for name in STRUCT_CLASSES for field in (name, name + '_covered') ]
+
+def coverage_fields(sst_included):
+    return COVERAGE_FIELDS + STRUCT_FIELDS if sst_included else COVERAGE_FIELDS
+
+# Per-protein coverage of the hits in a MatchTable, or of the hits of some of its
+# peptides. The hits are intervals in the shared sequence buffer of the records
+# with hits: the coverage depth of every residue is the cumulative sum of +1 at
+# the interval starts and -1 at the ends, and the covered residues of a record are
+# summed over its slice of the buffer. A peptide is unique if all its hits are in
+# one record and shared otherwise; unique_covered counts the residues covered by
+# unique peptides. With structural annotations the residues of every structural
+# class are counted next to those of them that are covered.
+class ProteinCoverage:
+
+    def __init__(self, table, peptides = None):
+        self.table = table.finish()
+        n_records = len(table.record_ids)
+        rows = slice(None)
+        if peptides is not None:
+            ids = [ table.peptide_ids[peptide] for peptide in peptides if peptide in table.peptide_ids ]
+            rows = np.isin(table.peptide_index, ids)
+        peptide = table.peptide_index[rows].astype(np.int64)
+        record = table.record[rows].astype(np.int64)
+        base = table.seq_offsets[record]
+        starts = base + table.columns['start_index'][rows]
+        ends = base + table.end[rows]
+        self.offsets = table.seq_offsets
+        self.length = np.diff(self.offsets)
+        self.counts = { 'hits': np.bincount(record, minlength = n_records) }
+        # distinct (peptide, record) pairs
+        pairs = np.unique(peptide * n_records + record)
+        pair_peptide = pairs // n_records
+        pair_record = pairs % n_records
+        records_per_peptide = np.bincount(pair_peptide, minlength = len(table.peptides))
+        unique = records_per_peptide[pair_peptide] == 1
+        self.counts['peptides'] = np.bincount(pair_record, minlength = n_records)
+        self.counts['unique_peptides'] = np.bincount(pair_record[unique], minlength = n_records)
+        covered = self.mask(starts, ends)
+        unique_hits = records_per_peptide[peptide] == 1
+        self.counts['covered'] = self.per_record(covered)
+        self.counts['unique_covered'] = self.per_record(self.mask(starts[unique_hits], ends[unique_hits]))
+        if table.matcher.sst_included:
+            classes = {
+                'helix': self.track_flags('sst', lambda values: np.isin(values, np.frombuffer(HELIX, dtype = np.uint8))),
+                'strand': self.track_flags('sst', lambda values: np.isin(values, np.frombuffer(STRAND, dtype = np.uint8))),
+                'membrane': self.track_flags('tm', lambda values: values != ord(NO_TM)),
+                'exposed': self.track_flags('acc', lambda values: values >= EXPOSED_ACC)
+            }
+            for name, flags in classes.items():
+                self.counts[name] = self.per_record(flags)
+                self.counts[name + '_covered'] = self.per_record(flags & covered)
+
+    # residues of the sequence buffer covered by at least one of the intervals
+    def mask(self, starts, ends):
+        n = len(self.table.seq)
+        depth = np.cumsum(np.bincount(starts, minlength = n + 1)[:n] - np.bincount(ends, minlength = n + 1)[:n])
+        return depth > 0
+
+    # sums of a per-residue array over the records, every record with hits has residues
+    def per_record(self, flags):
+        if not len(self.length):
+            return np.zeros(0, dtype = np.int64)
+        return np.add.reduceat(flags, self.offsets[:-1], dtype = np.int64)
+
+    # a per-residue flag of a structural class, False for records whose track does
+    # not cover the sequence
+    def track_flags(self, track, test):
+        table = self.table
+        values = table.track_buffer(track)
+        track_offsets = table.track_offsets[track]
+        aligned = np.diff(track_offsets) == self.length
+        if aligned.all():
+            return test(values)
+        flags = np.zeros(len(table.seq), dtype = bool)
+        for i in np.flatnonzero(aligned):
+            flags[self.offsets[i]:self.offsets[i + 1]] = test(values[track_offsets[i]:track_offsets[i + 1]])
+        return flags
+
+    # one row per record with hits, in database order
+    def rows(self):
+        fields = coverage_fields(self.table.matcher.sst_included)
+        counts = { name: values.tolist() for name, values in self.counts.items() }
+        lengths = self.length.tolist()
+        record_ids = self.table.record_ids
+        for i in np.flatnonzero(self.counts['hits']).tolist():
+            values = { name: counts[name][i] for name in counts }
+            values['record_id'] = record_ids[i]
+            values['length'] = lengths[i]
+            values['shared_peptides'] = values['peptides'] - values['unique_peptides']
+            values['coverage'] = round(values['covered'] / lengths[i], 4)
+            yield { field: values[field] for field in fields }
@@ -0,0 +1,349 @@
+from array import array
+from bisect import bisect_right
+from time import perf_counter
+import mmap
+import os
+import re
+import struct
+
+# Binary database layout: a header, a section table with one entry per track and,
+# for each track, an offset table (n_records + 1 little-endian uint64) followed by
+# the track blob. Every item in a blob is terminated by a newline byte, so that the
+# residue blob can be scanned in one go without matches spanning two records.
+MAGIC = b'PMDB'
+VERSION = 1
+FLAG_SECSTRUCT = 1
+TRACKS = [ 'id', 'seq', 'sst', 'tm', 'conf', 'acc' ]
+STRUCT_TRACKS = TRACKS[2:]
+SEPARATOR = b'\n'
+HEADER  = struct.Struct('<4sIIQ')
+SECTION = struct.Struct('<QQQ')
+CHUNK_SIZE = 1 << 24
+
+sst_re   = re.compile(r'secstruct:([^\s]+)')
+acc_re   = re.compile(r'accessibility:([^\s]+)')
+conf_re  = re.compile(r'confidence:([^\s]+)')
+tm_re    = re.compile(r'transmembrane:([^\s]+)')
+cigar_re = re.compile(r'(\d+)(.)')
+
+def hexpairs(s, regex):
+    match = regex.search(s)
+    if match:
+        return bytes.fromhex(match.group(1))
+    else:
+        return b''
+
+def decompress(s, regex):
+    match = regex.search(s)
+    if match:
+        line = match.group(1)
+        return ''.join(char * int(num) for num, char in cigar_re.findall(line)).encode('ascii')
+    else:
+        return b''
+
+def decode_tracks(description):
+    return {
+        'sst':  decompress(description, sst_re),
+        'tm':   decompress(description, tm_re),
+        'conf': hexpairs(description, conf_re),
+        'acc':  hexpairs(description, acc_re)
+    }
+
+EMPTY_TRACKS = { track: b'' for track in STRUCT_TRACKS }
+
+class Record:
+
+    __slots__ = ('index', 'id', 'seq', '_tracks')
+
+    def __init__(self, index, id, seq):
+        self.index = index
+        self.id = id
+        self.seq = seq
+        self._tracks = None
+
+    # structural tracks are only decoded once a hit actually needs them
+    @property
+    def tracks(self):
+        if self._tracks is None:
+            self._tracks = self.decode_tracks()
+        return self._tracks
+
+    def decode_tracks(self):
+        return EMPTY_TRACKS
+
+    # records travel between processes with their tracks already decoded
+    def __reduce__(self):
+        return (restore_record, (self.index, self.id, self.seq, self.tracks))
+
+def restore_record(index, id, seq, tracks):
+    record = Record(index, id, seq)
+    record._tracks = tracks
+    return record
+
+class FastaRecord(Record):
+
+    __slots__ = ('description',)
+
+    def __init__(self, index, id, seq, description):
+        super().__init__(index, id, seq)
+        self.description = description
+
+    def decode_tracks(self):
+        tracks = decode_tracks(self.description)
+        self.description = None
+        return tracks
+
+class IndexedRecord(Record):
+
+    __slots__ = ('database',)
+
+    def __init__(self, index, id, seq, database):
+        super().__init__(index, id, seq)
+        self.database = database
+
+    def decode_tracks(self):
+        return { track: bytes(self.database.item(track, self.index)) for track in STRUCT_TRACKS }
+
+def read_lines(handle, start, end):
+    handle.seek(start)
+    pos = start
+    while pos < end:
+        line = handle.readline()
+        if not line: break
+        pos += len(line)
+        yield line.decode('utf-8')
+
+def next_record(handle, pos):
+    handle.seek(pos - 1)
+    handle.readline()
+    while True:
+        pos = handle.tell()
+        line = handle.readline()
+        if not line or line.startswith(b'>'):
+            return pos
+
+class FastaDatabase:
+
+    # record indices yielded by scan() are relative to the shard
+    relative_shard_index = True
+
+    def __init__(self, fasta, sst_included):
+        self.fasta = fasta
+        self.sst_included = sst_included
+
+    def parse(self, shard = None):
+        for title, seq, bytes_read in self.read(shard):
+            yield title, seq
+
+    # (title, seq, bytes read so far), the byte count follows the buffering of the
+    # file and counts compressed bytes for compressed files
+    def read(self, shard = None):
+        # Bio.SeqIO takes longer to import than most runs on an indexed database
+        from Bio.SeqIO.FastaIO import SimpleFastaParser
+        from peptide_matcher import pmCompress
+        if shard is not None:
+            with open(self.fasta, 'rb') as handle:
+                for title, seq in SimpleFastaParser(read_lines(handle, *shard)):
+                    yield title, seq, handle.tell() - shard[0]
+        elif isinstance(self.fasta, str):
+            with pmCompress.open_input(self.fasta) as handle:
+                for title, seq in SimpleFastaParser(handle):
+                    yield title, seq, pmCompress.bytes_read(handle)
+        else:
+            bytes_read = 0
+            for title, seq in SimpleFastaParser(self.fasta):
+                bytes_read += len(title) + len(seq) + 2
+                yield title, seq, bytes_read
+
+    def size(self):
+        return os.path.getsize(self.fasta) if isinstance(self.fasta, str) else None
+
+    # byte ranges starting at record boundaries, only possible for uncompressed
+    # files on disk
+    def shards(self, n):
+        from peptide_matcher import pmCompress
+        if not isinstance(self.fasta, str) or pmCompress.detect(self.fasta):
+            return None
+        size = os.path.getsize(self.fasta)
+        bounds = [ 0 ]
+        with open(self.fasta, 'rb') as handle:
+            for i in range(1, n):
+                pos = next_record(handle, max(size * i // n, 1))
+                if bounds[-1] < pos < size:
+                    bounds.append(pos)
+        bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def scan(self, automaton, shard = None, stats = None):
+        index = -1
+        last_read = 0
+        time_start = perf_counter()
+        for index, (title, seq, bytes_read) in enumerate(self.read(shard)):
+            time_parsed = perf_counter()
+            hits = list(automaton.iter(seq))
+            if stats is not None:
+                stats.add_records(1, len(seq), bytes_read - last_read, time_parsed - time_start, perf_counter() - time_parsed)
+                last_read = bytes_read
+            record = None
+            for end_index, peptide in hits:
+                if record is None:
+                    id = title.split(None, 1)[0] if title else ''
+                    if self.sst_included:
+                        record = FastaRecord(index, id, seq, title)
+                    else:
+                        record = Record(index, id, seq)
+                yield record, end_index, peptide
+            time_start = perf_counter()
+        self.records_scanned = index + 1
+
+class IndexedDatabase:
+
+    relative_shard_index = False
+
+    def __init__(self, path, sst_included = True):
+        self.path = path
+        with open(path, 'rb') as fh:
+            self.mmap = mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, flags, self.n_records = HEADER.unpack_from(self.mmap)
+        assert magic == MAGIC, "'%s' is not an indexed peptide_matcher database" % path
+        assert version == VERSION, "Unsupported database version %d in '%s'" % (version, path)
+        self.sst_included = sst_included and bool(flags & FLAG_SECSTRUCT)
+        view = memoryview(self.mmap)
+        self.sections = {}
+        self.offsets = {}
+        self.blobs = {}
+        for i, track in enumerate(TRACKS):
+            offsets_pos, blob_pos, blob_len = self.sections[track] = SECTION.unpack_from(self.mmap, HEADER.size + i * SECTION.size)
+            self.offsets[track] = view[offsets_pos:blob_pos].cast('Q')
+            self.blobs[track] = view[blob_pos:blob_pos + blob_len]
+        view.release()
+
+    def __reduce__(self):
+        return (IndexedDatabase, (self.path, self.sst_included))
+
+    def item(self, track, index):
+        offsets = self.offsets[track]
+        return self.blobs[track][offsets[index]:offsets[index + 1] - 1]
+
+    def record(self, index):
+        id = str(self.item('id', index), 'utf-8')
+        seq = str(self.item('seq', index), 'ascii')
+        if self.sst_included:
+            return IndexedRecord(index, id, seq, self)
+        return Record(index, id, seq)
+
+    # record ranges holding roughly the same number of residues
+    def shards(self, n):
+        offsets = self.offsets['seq']
+        total = offsets[self.n_records]
+        bounds = [ 0 ]
+        for i in range(1, n):
+            index = bisect_right(offsets, total * i // n, 0, self.n_records)
+            if bounds[-1] < index < self.n_records:
+                bounds.append(index)
+        bounds.append(self.n_records)
+        return list(zip(bounds, bounds[1:]))
+
+    def size(self):
+        return len(self.blobs['seq'])
+
+    def scan(self, automaton, shard = None, stats = None):
+        offsets = self.offsets['seq']
+        blob = self.blobs['seq']
+        first, stop = shard if shard is not None else (0, self.n_records)
+        self.records_scanned = stop - first
+        while first < stop:
+            # scan whole runs of records at once, cut at record boundaries
+            last = bisect_right(offsets, offsets[first] + CHUNK_SIZE, first + 1, stop + 1) - 1
+            last = max(last, first + 1)
+            base = offsets[first]
+            time_start = perf_counter()
+            text = str(blob[base:offsets[last]], 'ascii')
+            time_parsed = perf_counter()
+            hits = list(automaton.iter(text))
+            if stats is not None:
+                stats.add_records(last - first, len(text) - (last - first), len(text), time_parsed - time_start, perf_counter() - time_parsed)
+            index = first
+            record_start = 0
+            record_end = offsets[index + 1] - base
+            record = None
+            for end_index, peptide in hits:
+                while end_index >= record_end:
+                    index += 1
+                    record_start = record_end
+                    record_end = offsets[index + 1] - base
+                    record = None
+                if record is None:
+                    record = self.record(index)
+                yield record, end_index - record_start, peptide
+            first = last
+
+    def close(self):
+        for track in TRACKS:
+            self.offsets[track].release()
+            self.blobs[track].release()
+        self.mmap.close()
+
+def is_indexed(path):
+    try:
+        with open(path, 'rb') as fh:
+            return fh.read(len(MAGIC)) == MAGIC
+    except (TypeError, OSError):
+        return False
+
+def open_database(database, sst_included):
+    if isinstance(database, (FastaDatabase, IndexedDatabase)):
+        return database
+    if is_indexed(database):
+        return IndexedDatabase(database, sst_included)
+    return FastaDatabase(database, sst_included)
+
+# A new file with a unique name in directory, for writing a file that is then moved
+# into place: (file descriptor, path). mkstemp creates files that only their owner
+# can read, indexes and caches are shared between users; this file gets the mode of
+# any new file under the umask.
+def temp_file(directory, suffix = '.tmp'):
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        path = os.path.join(directory, 'tmp' + os.urandom(8).hex() + suffix)
+        try:
+            return os.open(path, flags, 0o666), path
+        except FileExistsError:
+            pass
+
+def build_index(fasta, output, sst_included):
+    blobs = { track: bytearray() for track in TRACKS }
+    offsets = { track: array('Q', [ 0 ]) for track in TRACKS }
+    n_records = 0
+    for title, seq in FastaDatabase(fasta, sst_included).parse():
+        id = title.split(None, 1)[0] if title else ''
+        items = { 'id': id.encode('utf-8'), 'seq': seq.encode('ascii') }
+        if sst_included:
+            items.update(decode_tracks(title))
+        for track in TRACKS:
+            blob = blobs[track]
+            blob += items.get(track, b'')
+            blob += SEPARATOR
+            offsets[track].append(len(blob))
+        n_records += 1
+    assert n_records > 0, "The database seems empty"
+
+    sections = []
+    pos = HEADER.size + SECTION.size * len(TRACKS)
+    for track in TRACKS:
+        pos += -pos % 8
+        offsets_pos = pos
+        pos += len(offsets[track]) * offsets[track].itemsize
+        sections.append((offsets_pos, pos, len(blobs[track])))
+        pos += len(blobs[track])
+
+    flags = FLAG_SECSTRUCT if sst_included else 0
+    with open(output, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, flags, n_records))
+        for section in sections:
+            out.write(SECTION.pack(*section))
+        for track, (offsets_pos, blob_pos, blob_len) in zip(TRACKS, sections):
+            out.write(b'\0' * (offsets_pos - out.tell()))
+            offsets[track].tofile(out)
+            out.write(blobs[track])
+    return n_records
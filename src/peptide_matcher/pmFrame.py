@@ -1,12 +1,38 @@
 from peptide_matcher.gui import BasicFrame
-from peptide_matcher import PeptideMatcher, wrap_logos, wrap_scores
+from peptide_matcher.peptideMatcher import PeptideMatcher, tsv_header
+from peptide_matcher.pmCompress import open_input
+from peptide_matcher.pmGrid import MatchGridTable, COLUMN_LABELS
+from peptide_matcher.pmXlsx import XlsxWriter
 import wx
-import xlsxwriter
+import wx.grid
+import threading
 import traceback
 from time import time
 
+class Cancelled(Exception):
+    pass
+
 class PMFrame(BasicFrame):
 
+    def __init__(self, *args, **kwds):
+        super().__init__(*args, **kwds)
+        self.worker = None
+        self.grid_table = None
+        self.CreateStatusBar()
+        # filter controls above the grid, sorting by clicking on a column label
+        sizer_filter = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_filter.Add(wx.StaticText(self, wx.ID_ANY, 'Filter'), 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        self.choice_filter = wx.Choice(self, wx.ID_ANY, choices = COLUMN_LABELS)
+        self.choice_filter.SetSelection(0)
+        sizer_filter.Add(self.choice_filter, 0, wx.ALL, 5)
+        self.text_filter = wx.TextCtrl(self, wx.ID_ANY, '', style = wx.TE_PROCESS_ENTER)
+        sizer_filter.Add(self.text_filter, 0, wx.ALL, 5)
+        self.GetSizer().Insert(1, sizer_filter, 0, 0, 0)
+        self.Layout()
+        self.Bind(wx.EVT_TEXT_ENTER, self.on_filter, self.text_filter)
+        self.Bind(wx.EVT_CHOICE, self.on_filter, self.choice_filter)
+        self.grid_matches.Bind(wx.grid.EVT_GRID_LABEL_LEFT_CLICK, self.on_label_click)
+
     def on_button_fasta(self, event):
         dlg = wx.FileDialog(self, message='Choose database fasta file', defaultFile='', style=(wx.FD_OPEN | wx.FD_CHANGE_DIR))
         if dlg.ShowModal() == wx.ID_OK:
@@ -26,94 +52,96 @@ class PMFrame(BasicFrame):
         dlg.Destroy()
 
     def on_button_run(self, event):
-        self.grid_matches.ClearGrid()
-        num_rows = self.grid_matches.GetNumberRows()
-        if num_rows > 0:
-            self.grid_matches.DeleteRows(numRows=num_rows)
+        if self.worker is not None:
+            self.cancel.set()
+            self.button_run.Enable(False)
+            self.SetStatusText('Cancelling...')
+            return
         fasta = self.text_fasta.GetValue()
         secstruct_included = self.radio_box_secstruct.GetSelection()
         peptides = self.text_peptides.GetValue()
         flanks = int(self.spin_flanks.GetValue())
-        progress_dialog = wx.ProgressDialog('Matching...', 'Matching the peptides...', parent=self, style=(wx.PD_APP_MODAL | wx.PD_AUTO_HIDE))
-        progress_dialog.Pulse()
+        self.cancel = threading.Event()
+        self.worker = threading.Thread(target = self.match_worker, args = (peptides, fasta, secstruct_included, flanks), daemon = True)
+        self.time_start = time()
+        self.button_run.SetLabel('Cancel')
+        self.button_save.Enable(False)
+        self.SetStatusText('Matching the peptides...')
+        self.worker.start()
 
-        time_start = time()
-        with open(peptides) as peptides_fp:
-            peptide_matcher = PeptideMatcher(peptides_fp, fasta, secstruct_included, flanks)
-            try:
-                row = 0
-                for output in peptide_matcher.run():
-                    peptide = output['peptide']
-                    peplen = len(peptide)
-                    if output['matches']:
-                        n_logo = wrap_logos(output['n_logos'])
-                        c_logo = wrap_logos(output['c_logos'])
-                        for match in output['matches']:
-                            self.grid_matches.AppendRows()
-                            self.grid_matches.SetCellValue(row, 0, peptide)
-                            self.grid_matches.SetCellValue(row, 1, str(peplen))
-                            self.grid_matches.SetCellValue(row, 2, match['record_id'])
-                            self.grid_matches.SetCellValue(row, 3, str(match['start']))
-                            self.grid_matches.SetCellValue(row, 4, str(match['end']))
-                            self.grid_matches.SetCellValue(row, 5, str(match['c_term']))
-                            self.grid_matches.SetCellValue(row, 6, match['n_flank'])
-                            self.grid_matches.SetCellValue(row, 7, match['c_flank'])
-                            self.grid_matches.SetCellValue(row, 8, n_logo)
-                            self.grid_matches.SetCellValue(row, 9, c_logo)
-                            if secstruct_included:
-                                self.grid_matches.SetCellValue(row, 10, match['sst_n_term'])
-                                self.grid_matches.SetCellValue(row, 11, match['sst_pept'])
-                                self.grid_matches.SetCellValue(row, 12, match['sst_c_term'])
-                                self.grid_matches.SetCellValue(row, 13, match['tm_n_term'])
-                                self.grid_matches.SetCellValue(row, 14, match['tm_pept'])
-                                self.grid_matches.SetCellValue(row, 15, match['tm_c_term'])
-                                self.grid_matches.SetCellValue(row, 16, wrap_scores(match['conf_n_term']))
-                                self.grid_matches.SetCellValue(row, 17, wrap_scores(match['conf_pept']))
-                                self.grid_matches.SetCellValue(row, 18, wrap_scores(match['conf_c_term']))
-                                self.grid_matches.SetCellValue(row, 19, wrap_scores(match['acc_n_term']))
-                                self.grid_matches.SetCellValue(row, 20, wrap_scores(match['acc_pept']))
-                                self.grid_matches.SetCellValue(row, 21, wrap_scores(match['acc_c_term']))
-                        row += 1
-                    else:
-                        self.grid_matches.AppendRows()
-                        self.grid_matches.SetCellValue(row, 0, peptide)
-                        self.grid_matches.SetCellValue(row, 1, str(peplen))
-                        self.grid_matches.SetCellValue(row, 2, 'No match')
-                        row += 1
-                    progress_dialog.Pulse()
+    # runs in the worker thread, the results are handed over to the UI thread
+    def match_worker(self, peptides, fasta, secstruct_included, flanks):
+        def progress(stats):
+            if self.cancel.is_set():
+                raise Cancelled()
+            wx.CallAfter(self.show_progress, stats.fraction, stats.records, stats.hits, stats.stage)
 
-                self.button_save.Enable(True)
-            except Exception as e:
-                try:
-                    msg_dialog = wx.MessageDialog(self, '%s:\n%s' % (str(e), traceback.format_exc()), 'Error', wx.OK | wx.ICON_ERROR)
-                    msg_dialog.ShowModal()
-                    msg_dialog.Destroy()
-                finally:
-                    e = None
-                    del e
+        try:
+            with open_input(peptides) as peptides_fp:
+                peptide_matcher = PeptideMatcher(peptides_fp, fasta, secstruct_included, flanks, progress = progress)
+                table = peptide_matcher.match_table()
+            table.logos()
+        except Cancelled:
+            wx.CallAfter(self.on_match_done, None, None, None)
+        except Exception as e:
+            wx.CallAfter(self.on_match_done, None, None, '%s:\n%s' % (str(e), traceback.format_exc()))
+        else:
+            wx.CallAfter(self.on_match_done, peptide_matcher, table, None)
 
-        print("Run time: " + str(time() - time_start))
-        progress_dialog.Destroy()
+    def show_progress(self, fraction, records, hits, stage):
+        if self.worker is None:
+            return
+        if stage == 'scan':
+            done = '%.1f%%, ' % (fraction * 100) if fraction is not None else ''
+            self.SetStatusText('Scanning the database: %s%d records, %d hits' % (done, records, hits))
+        else:
+            self.SetStatusText('Collecting %d hits...' % hits)
 
-    def on_button_save(self, event):
-        dlg = wx.FileDialog(self, message='Choose file to save the output', wildcard='MS Excel 2007 Spreadsheets (*.xlsx)|*.xlsx', style=(wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT))
-        if dlg.ShowModal() == wx.ID_OK:
-            outputPath = dlg.GetPath()
-            table = self.grid_matches.GetTable()
-            row_num = table.GetNumberRows()
-            col_num = table.GetNumberCols()
-            workbook = xlsxwriter.Workbook(outputPath)
-            worksheet = workbook.add_worksheet()
-            cell_format = workbook.add_format({'bold': True})
-            worksheet.set_row(0, None, cell_format)
-            for col in range(col_num):
-                val = self.grid_matches.GetColLabelValue(col)
-                worksheet.write(0, col, val)
+    def on_match_done(self, peptide_matcher, table, error):
+        self.worker = None
+        self.button_run.SetLabel('Run!')
+        self.button_run.Enable(True)
+        if error is not None:
+            self.SetStatusText('')
+            msg_dialog = wx.MessageDialog(self, error, 'Error', wx.OK | wx.ICON_ERROR)
+            msg_dialog.ShowModal()
+            msg_dialog.Destroy()
+            return
+        if table is None:
+            self.SetStatusText('Cancelled')
+            return
+        grid_table = self.grid_table = MatchGridTable(peptide_matcher, table)
+        self.grid_matches.SetTable(grid_table, True)
+        self.on_filter(None)
+        self.button_save.Enable(True)
+        self.SetStatusText('%d rows in %.1f s' % (grid_table.GetNumberRows(), time() - self.time_start))
+
+    def on_label_click(self, event):
+        col = event.GetCol()
+        if self.grid_table is None or col < 0:
+            return
+        ascending = not (self.grid_table.sort_column == col and self.grid_table.ascending)
+        self.grid_table.sort(col, ascending)
+        self.grid_matches.SetSortingColumn(col, ascending)
+        self.grid_matches.ForceRefresh()
 
-            for row in range(row_num):
-                for col in range(col_num):
-                    val = table.GetValue(row, col)
-                    worksheet.write(row + 1, col, val)
+    def on_filter(self, event):
+        if self.grid_table is None:
+            return
+        old_rows = self.grid_table.GetNumberRows()
+        self.grid_table.filter(self.choice_filter.GetSelection(), self.text_filter.GetValue().strip())
+        self.grid_table.refresh(self.grid_matches, old_rows)
 
-            workbook.close()
+    def on_button_save(self, event):
+        dlg = wx.FileDialog(self, message='Choose file to save the output', wildcard='MS Excel 2007 Spreadsheets (*.xlsx)|*.xlsx', style=(wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT))
+        if dlg.ShowModal() == wx.ID_OK and self.grid_table is not None:
+            # the rows as currently sorted and filtered, one at a time
+            busy = wx.BusyCursor()
+            writer = XlsxWriter(dlg.GetPath(), tsv_header, COLUMN_LABELS)
+            try:
+                for row in self.grid_table.view:
+                    writer.writerow(self.grid_table.fields(row))
+            finally:
+                writer.close()
+                del busy
         dlg.Destroy()
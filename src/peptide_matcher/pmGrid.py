@@ -0,0 +1,189 @@
+from peptide_matcher.peptideMatcher import tsv_header, match_row, wrap_logos
+import numpy as np
+import wx
+import wx.grid
+
+COLUMN_LABELS = [ 'Peptide', 'Length', 'Protein', 'Start', 'End', 'C-term', 'N-flank', 'C-flank', 'N-flank*', 'C-flank*', 'N-flank SS', 'Peptide SS', 'C-flank SS', 'N-flank TM', 'Peptide TM', 'C-flank TM', 'N-flank conf', 'Peptide conf', 'C-flank conf', 'N-flank RSA', 'Peptide RSA', 'C-flank RSA' ]
+CACHE_ROWS = 1000
+# the window of the sequence or of a structural track shown by a column
+WINDOW_COLUMNS = { 'n_flank': ('seq', 'n_term'), 'c_flank': ('seq', 'c_term') }
+WINDOW_COLUMNS.update({ '%s_%s' % (track, part): (track, part) for track in ('sst', 'tm', 'conf', 'acc') for part in ('n_term', 'pept', 'c_term') })
+# columns with values in the 'No match' rows, these rows go last when sorting by any other column
+PEPTIDE_COLUMNS = ('peptide', 'peplen')
+
+# Virtual grid table over the MatchTable of a run: one row per hit, in the order
+# of PeptideMatcher.run(), and a 'No match' row for every peptide without hits.
+# Cells are only materialised when the grid asks for them; sorting and filtering
+# rearrange an array of row numbers and leave the hits where they are.
+class MatchGridTable(wx.grid.GridTableBase):
+
+    def __init__(self, matcher, table):
+        super().__init__()
+        self.matcher = matcher
+        self.table = table.finish()
+        self.flank_logos = table.logos()
+        self.peptides = [ peptide for sample, peptide in matcher.sample_peptides ]
+        hits = []
+        peptide_rows = []
+        for i, peptide in enumerate(self.peptides):
+            rows = self.table.rows(peptide)
+            if not len(rows):
+                rows = np.array([ -1 ])
+            hits.append(rows)
+            peptide_rows.append(np.full(len(rows), i))
+        self.hit = np.concatenate(hits).astype(np.int64)
+        self.peptide = np.concatenate(peptide_rows)
+        self.view = np.arange(len(self.hit))
+        self.sort_column = None
+        self.ascending = True
+        self.filter_column = None
+        self.filter_text = ''
+        self.cache = {}
+        self.column_values = {}
+        self.logo_strings = {}
+
+    def GetNumberRows(self):
+        return len(self.view)
+
+    def GetNumberCols(self):
+        return len(tsv_header)
+
+    def GetColLabelValue(self, col):
+        return COLUMN_LABELS[col]
+
+    def IsEmptyCell(self, row, col):
+        return False
+
+    def GetValue(self, row, col):
+        return str(self.fields(self.view[row]).get(tsv_header[col], ''))
+
+    def SetValue(self, row, col, value):
+        pass
+
+    def logos(self, peptide):
+        if peptide not in self.logo_strings:
+            n_logos, c_logos = self.flank_logos.logos(peptide)
+            self.logo_strings[peptide] = wrap_logos(n_logos), wrap_logos(c_logos)
+        return self.logo_strings[peptide]
+
+    # the tabular fields of a row of the underlying table
+    def fields(self, row):
+        fields = self.cache.get(row)
+        if fields is not None:
+            return fields
+        peptide = self.peptides[self.peptide[row]]
+        hit = self.hit[row]
+        if hit < 0:
+            fields = { 'peptide': peptide, 'peplen': len(peptide), 'record_id': 'No match' }
+        else:
+            columns = self.table.columns
+            record = self.table.record_view(columns['record'][hit])
+            match = self.matcher.match(record, int(columns['start_index'][hit]), int(columns['end'][hit]), peptide)
+            n_logos, c_logos = self.logos(peptide)
+            fields = match_row(peptide, match, n_logos, c_logos, self.matcher.sst_included)
+        if len(self.cache) >= CACHE_ROWS:
+            self.cache.clear()
+        self.cache[row] = fields
+        return fields
+
+    # sort keys of a column for all rows, numbers or ranks where possible
+    def column_keys(self, col):
+        field = tsv_header[col]
+        hit = np.maximum(self.hit, 0)
+        if field == 'peptide':
+            ranks = np.argsort(np.argsort(np.array(self.peptides)))
+            return ranks[self.peptide]
+        if field == 'peplen':
+            return np.array([ len(peptide) for peptide in self.peptides ])[self.peptide]
+        if field in ('n_logos', 'c_logos'):
+            ranks = np.argsort(np.argsort(self.peptide_logos(field)))
+            return ranks[self.peptide]
+        if not len(self.table):
+            return np.zeros(len(self.hit), dtype = np.int64)
+        if field == 'record_id':
+            ranks = np.argsort(np.argsort(np.array(self.table.record_ids)))
+            return ranks[self.table.record[hit]]
+        if field in ('start', 'end', 'c_term'):
+            return getattr(self.table, field)[hit]
+        return self.values(col)
+
+    # the cell values of a column for all rows, computed from the hit columns and
+    # the shared buffers of the table without materialising the rows
+    def values(self, col):
+        if col not in self.column_values:
+            self.column_values[col] = self.column_strings(tsv_header[col])
+        return self.column_values[col]
+
+    # the logos of every peptide, the logo columns are sorted and filtered per peptide
+    def peptide_logos(self, field):
+        i = 0 if field == 'n_logos' else 1
+        with_hits = set(self.peptide[self.hit >= 0].tolist())
+        return np.array([ self.logos(peptide)[i] if p in with_hits else '' for p, peptide in enumerate(self.peptides) ])
+
+    def column_strings(self, field):
+        has_hit = self.hit >= 0
+        if field == 'peptide':
+            return np.array(self.peptides)[self.peptide]
+        if field == 'peplen':
+            return np.array([ str(len(peptide)) for peptide in self.peptides ])[self.peptide]
+        if field in ('n_logos', 'c_logos'):
+            return self.peptide_logos(field)[self.peptide]
+        no_match = 'No match' if field == 'record_id' else ''
+        track = WINDOW_COLUMNS.get(field, ('seq',))[0]
+        if not len(self.table) or track != 'seq' and not self.matcher.sst_included:
+            return np.full(len(self.hit), no_match)
+        if field == 'record_id':
+            values = np.array(self.table.record_ids)[self.table.record]
+        elif field in ('start', 'end', 'c_term'):
+            values = getattr(self.table, field).astype(str)
+        else:
+            values = self.table.window_strings(*WINDOW_COLUMNS[field])
+        return np.where(has_hit, values[np.maximum(self.hit, 0)], no_match)
+
+    def matches_filter(self):
+        col = self.filter_column
+        text = self.filter_text.upper()
+        field = tsv_header[col]
+        if field == 'peptide':
+            return np.array([ text in peptide for peptide in self.peptides ])[self.peptide]
+        if field in ('n_logos', 'c_logos'):
+            return np.array([ text in logos.upper() for logos in self.peptide_logos(field) ])[self.peptide]
+        if field == 'record_id' and len(self.table):
+            found = np.array([ text in id.upper() for id in self.table.record_ids ])
+            return np.where(self.hit >= 0, found[self.table.record[np.maximum(self.hit, 0)]], text in 'NO MATCH')
+        return np.char.find(np.char.upper(self.values(col)), text) >= 0
+
+    def update_view(self):
+        view = np.arange(len(self.hit))
+        if self.filter_column is not None and self.filter_text:
+            view = view[self.matches_filter()]
+        if self.sort_column is not None:
+            keys = self.column_keys(self.sort_column)[view]
+            view = view[np.argsort(keys, kind = 'stable')]
+            if not self.ascending:
+                view = view[::-1]
+            if tsv_header[self.sort_column] not in PEPTIDE_COLUMNS:
+                no_match = self.hit[view] < 0
+                view = np.concatenate([ view[~no_match], view[no_match] ])
+        self.view = view
+
+    def sort(self, col, ascending = True):
+        self.sort_column = col
+        self.ascending = ascending
+        self.update_view()
+
+    def filter(self, col, text):
+        self.filter_column = col
+        self.filter_text = text
+        self.update_view()
+
+    # tells the grid about a changed number of rows after sorting or filtering
+    def refresh(self, grid, old_rows):
+        new_rows = self.GetNumberRows()
+        grid.BeginBatch()
+        if new_rows < old_rows:
+            grid.ProcessTableMessage(wx.grid.GridTableMessage(self, wx.grid.GRIDTABLE_NOTIFY_ROWS_DELETED, new_rows, old_rows - new_rows))
+        elif new_rows > old_rows:
+            grid.ProcessTableMessage(wx.grid.GridTableMessage(self, wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED, new_rows - old_rows))
+        grid.EndBatch()
+        grid.ForceRefresh()
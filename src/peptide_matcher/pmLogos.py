@@ -0,0 +1,115 @@
+import numpy as np
+
+ALPHABET = 'ACDEFGHIKLMNPQRSTVWY[]'
+CHUNK_ROWS = 1 << 16
+NONE = 0
+
+def normalize_counts(counts, normalize):
+    if normalize is None or normalize == 'counts':
+        return counts
+    totals = counts.sum(axis = -1, keepdims = True)
+    freqs = np.divide(counts, totals, out = np.zeros(counts.shape), where = totals > 0)
+    if normalize == 'frequency':
+        return freqs
+    if normalize == 'information':
+        # letter heights as in a sequence logo: frequency times information content
+        logs = np.log2(freqs, out = np.zeros(freqs.shape), where = freqs > 0)
+        entropy = -(freqs * logs).sum(axis = -1, keepdims = True)
+        return freqs * (np.log2(counts.shape[-1]) - entropy)
+    raise ValueError("Unknown normalization '%s'" % normalize)
+
+# Position frequency matrices of the N- and C-flanks of the hits in a MatchTable.
+# Flank letters of all hits are gathered from the shared sequence buffer in chunks
+# and counted per (peptide, position, letter) with numpy; the first hit in which a
+# letter is seen is kept as well, so that the logos can be returned as the same
+# insertion-ordered dicts as before.
+class FlankLogos:
+
+    def __init__(self, table):
+        self.table = table
+        self.flanks = table.flanks
+        self.n_counts = self.count(self.letters_n)
+        self.c_counts = self.count(self.letters_c)
+        codes = np.union1d(self.n_counts[2], self.c_counts[2])
+        extra = ''.join(chr(code) for code in codes if chr(code) not in ALPHABET)
+        self.alphabet = ALPHABET[:-2] + extra + ALPHABET[-2:]
+        self.columns = np.zeros(256, dtype = np.int64)
+        for i, letter in enumerate(self.alphabet):
+            self.columns[ord(letter)] = i
+        self.dicts = {}
+
+    def letters_n(self, rows):
+        table = self.table
+        pos = table.columns['start_index'][rows, None] - self.flanks + np.arange(self.flanks)
+        base = table.seq_offsets[table.columns['record'][rows]]
+        letters = table.seq_buffer[np.clip(base[:, None] + pos, 0, len(table.seq) - 1)]
+        return np.where(pos >= 0, letters, np.where(pos == -1, ord('['), NONE))
+
+    def letters_c(self, rows):
+        table = self.table
+        record = table.columns['record'][rows]
+        base = table.seq_offsets[record]
+        length = table.seq_offsets[record + 1] - base
+        pos = table.columns['end'][rows, None] + np.arange(self.flanks)
+        letters = table.seq_buffer[np.clip(base[:, None] + pos, 0, len(table.seq) - 1)]
+        return np.where(pos < length[:, None], letters, np.where(pos == length[:, None], ord(']'), NONE))
+
+    # sparse counts as (peptide, position, letter, count, first row) arrays
+    def count(self, letters):
+        n_rows = len(self.table)
+        keys = []
+        counts = []
+        firsts = []
+        for start in range(0, n_rows, CHUNK_ROWS):
+            rows = np.arange(start, min(start + CHUNK_ROWS, n_rows))
+            chunk = letters(rows)
+            peptide = self.table.columns['peptide'][rows].astype(np.int64)
+            key = (peptide[:, None] * self.flanks + np.arange(self.flanks)) * 256 + chunk
+            valid = chunk != NONE
+            key, index, count = np.unique(key[valid], return_index = True, return_counts = True)
+            keys.append(key)
+            counts.append(count)
+            firsts.append(np.broadcast_to(rows[:, None], chunk.shape)[valid][index])
+        if not keys:
+            empty = np.zeros(0, dtype = np.int64)
+            return empty, empty, empty, empty, empty
+        unique, inverse = np.unique(np.concatenate(keys), return_inverse = True)
+        count = np.zeros(len(unique), dtype = np.int64)
+        np.add.at(count, inverse, np.concatenate(counts))
+        first = np.full(len(unique), n_rows, dtype = np.int64)
+        np.minimum.at(first, inverse, np.concatenate(firsts))
+        peptide, rest = np.divmod(unique, self.flanks * 256)
+        position, letter = np.divmod(rest, 256)
+        return peptide, position, letter, count, first
+
+    def to_dicts(self, counts):
+        peptide, position, letter, count, first = counts
+        logos = {}
+        for i in np.lexsort((first, position, peptide)):
+            peptide_id = int(peptide[i])
+            if peptide_id not in logos:
+                logos[peptide_id] = [ {} for j in range(self.flanks) ]
+            logos[peptide_id][position[i]][chr(letter[i])] = int(count[i])
+        return logos
+
+    # the logos of a peptide as lists of {letter: count} dicts, one per flank position
+    def logos(self, peptide):
+        if not self.dicts:
+            self.dicts = { 'n': self.to_dicts(self.n_counts), 'c': self.to_dicts(self.c_counts) }
+        peptide_id = self.table.peptide_ids.get(peptide)
+        return self.dicts['n'].get(peptide_id, []), self.dicts['c'].get(peptide_id, [])
+
+    def matrix(self, counts, peptide_id):
+        peptide, position, letter, count, first = counts
+        select = slice(None) if peptide_id is None else peptide == peptide_id
+        matrix = np.zeros((self.flanks, len(self.alphabet)), dtype = np.int64)
+        np.add.at(matrix, (position[select], self.columns[letter[select]]), count[select])
+        return matrix
+
+    # flanks x alphabet matrices for one peptide, or for all peptides if none is given;
+    # normalize can be 'counts' (default), 'frequency' or 'information'
+    def matrices(self, peptide = None, normalize = None):
+        peptide_id = None if peptide is None else self.table.peptide_ids.get(peptide, -1)
+        n_matrix = self.matrix(self.n_counts, peptide_id)
+        c_matrix = self.matrix(self.c_counts, peptide_id)
+        return normalize_counts(n_matrix, normalize), normalize_counts(c_matrix, normalize)
@@ -0,0 +1,39 @@
+from peptide_matcher.pmStats import Stats
+from concurrent.futures import ProcessPoolExecutor
+
+SHARDS_PER_WORKER = 4
+
+worker_automaton = None
+worker_database = None
+
+def init_worker(automaton, database):
+    global worker_automaton, worker_database
+    worker_automaton = automaton
+    worker_database = database
+
+def scan_shard(shard):
+    stats = Stats()
+    hits = list(worker_database.scan(worker_automaton, shard, stats))
+    return hits, worker_database.records_scanned, stats.as_dict()
+
+def scan(database, automaton, workers, stats = None):
+    shards = database.shards(workers * SHARDS_PER_WORKER) if workers > 1 else None
+    if not shards or len(shards) < 2:
+        yield from database.scan(automaton, stats = stats)
+        return
+    # the automaton and the database handle are shipped once per worker, shards are
+    # consumed in order so that the hits come out exactly as in a serial scan
+    with ProcessPoolExecutor(workers, initializer = init_worker, initargs = (automaton, database)) as executor:
+        base = 0
+        for hits, records_scanned, counters in executor.map(scan_shard, shards):
+            if stats is not None:
+                stats.merge(counters)
+            last = None
+            for hit in hits:
+                record = hit[0]
+                if record is not last and database.relative_shard_index:
+                    record.index += base
+                last = record
+                yield hit
+            base += records_scanned
+    database.records_scanned = base
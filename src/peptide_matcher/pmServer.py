@@ -0,0 +1,228 @@
+from peptide_matcher.peptideMatcher import PeptideMatcher, tsv_fields
+from peptide_matcher import pmCache, pmDatabase
+from peptide_matcher.pmWriters import WRITERS
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import io
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+BUFFER_SIZE = 1 << 16
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'tsv': 'text/tab-separated-values',
+    'csv': 'text/csv'
+}
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.active = 0
+        self.errors = 0
+        self.peptides = 0
+        self.matches = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.per_database = {}
+
+    def begin(self):
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+
+    def end(self, database, peptides, matches, seconds, error = False):
+        with self.lock:
+            self.active -= 1
+            self.errors += error
+            self.peptides += peptides
+            self.matches += matches
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            if database is not None:
+                self.per_database[database] = self.per_database.get(database, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            completed = self.requests - self.active
+            return {
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+                'active': self.active,
+                'errors': self.errors,
+                'peptides': self.peptides,
+                'matches': self.matches,
+                'mean_seconds': self.seconds / completed if completed else 0.0,
+                'max_seconds': self.max_seconds,
+                'per_database': dict(self.per_database)
+            }
+
+# collects small writes and sends them in large pieces
+class ResponseWriter:
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.buffer = io.StringIO()
+
+    def write(self, s):
+        self.buffer.write(s)
+        if self.buffer.tell() >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.wfile.write(self.buffer.getvalue().encode('utf-8'))
+        self.buffer = io.StringIO()
+
+class MatchHandler(BaseHTTPRequestHandler):
+
+    server_version = 'peptide_matcher'
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def send_json(self, obj, status = 200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(self.server.metrics.snapshot())
+        elif self.path == '/databases':
+            self.send_json({ name: { 'records': database.n_records, 'secstruct': database.sst_included } for name, database in self.server.databases.items() })
+        else:
+            self.send_json({ 'error': 'Not found' }, 404)
+
+    # POST /match with a json object: database, peptides (list or newline-separated
+    # string), flanks (default: 4), secstruct, format (json, ndjson, tsv or csv), stream,
+    # equivalences (residue classes such as 'IL,QK'), max_mismatches and engine
+    def do_POST(self):
+        if self.path != '/match':
+            return self.send_json({ 'error': 'Not found' }, 404)
+        metrics = self.server.metrics
+        metrics.begin()
+        time_start = time.time()
+        database = None
+        peptides = []
+        n_matches = 0
+        error = True
+        # the request is always ended in the metrics, also if it fails unexpectedly
+        try:
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                assert isinstance(request, dict), 'The request must be a json object'
+                name = request.get('database')
+                if name is None and len(self.server.databases) == 1:
+                    name = next(iter(self.server.databases))
+                assert isinstance(name, str) and name in self.server.databases, "Unknown database '%s'" % name
+                database = name
+                peptides = request.get('peptides', [])
+                if isinstance(peptides, str):
+                    peptides = peptides.split()
+                assert isinstance(peptides, list) and all(isinstance(peptide, str) for peptide in peptides), 'peptides must be a list of strings or a newline-separated string'
+                secstruct = bool(request.get('secstruct', False))
+                output_format = request.get('format', 'json')
+                assert isinstance(output_format, str) and output_format in CONTENT_TYPES, "Unknown format '%s'" % output_format
+                equivalences = request.get('equivalences')
+                assert equivalences is None or isinstance(equivalences, str) or isinstance(equivalences, list) and all(isinstance(residues, str) for residues in equivalences), 'equivalences must be a string or a list of strings'
+                engine = request.get('engine', 'automaton')
+                assert isinstance(engine, str), "Unknown search engine '%s'" % engine
+                max_mismatches = int(request.get('max_mismatches', 0))
+                pm = PeptideMatcher(peptides, self.server.databases[name], secstruct, int(request.get('flanks', 4)), automaton_cache = self.server.automaton_cache, equivalences = equivalences, max_mismatches = max_mismatches, engine = engine)
+                outputs = pm.stream() if request.get('stream') else pm.run()
+                # malformed peptides are reported before the response is started
+                first = next(outputs, None)
+            except (AssertionError, ValueError, TypeError) as e:
+                return self.send_json({ 'error': str(e) }, 400)
+            except Exception as e:
+                self.send_json({ 'error': '%s: %s' % (type(e).__name__, e) }, 500)
+                raise
+
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPES[output_format])
+            self.end_headers()
+            try:
+                writer = WRITERS[output_format](ResponseWriter(self.wfile), tsv_fields(equivalences, max_mismatches), secstruct)
+                while first is not None:
+                    output = first
+                    if request.get('stream'):
+                        writer.write_match(output)
+                    else:
+                        writer.write_output(output)
+                    n_matches += len(output['matches']) if 'matches' in output else 1
+                    first = next(outputs, None)
+                writer.close()
+                error = False
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        finally:
+            metrics.end(database, len(peptides), n_matches, time.time() - time_start, error = error)
+
+class MatchServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+class UnixMatchServer(ThreadingMixIn, UnixStreamServer):
+
+    daemon_threads = True
+
+# fasta databases are indexed into a temporary directory so that every
+# database is served from one memory-mapped reader shared by all requests
+def load_databases(specs, sst_included, workdir):
+    databases = {}
+    for spec in specs:
+        name, sep, path = spec.partition('=')
+        if not sep:
+            path = spec
+            name = os.path.splitext(os.path.basename(path))[0]
+        assert name not in databases, "Duplicate database name '%s'" % name
+        if not pmDatabase.is_indexed(path):
+            indexed = os.path.join(workdir, '%d.pmdb' % len(databases))
+            pmDatabase.build_index(path, indexed, sst_included)
+            path = indexed
+        databases[name] = pmDatabase.IndexedDatabase(path)
+    return databases
+
+# a stale socket of an earlier server is replaced, any other file is left alone
+def check_socket_path(socket_path):
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    assert stat.S_ISSOCK(mode), "'%s' exists and is not a socket" % socket_path
+
+def serve(specs, sst_included = False, host = '127.0.0.1', port = 8080, socket_path = None, automaton_cache = None):
+    if socket_path:
+        check_socket_path(socket_path)
+    with tempfile.TemporaryDirectory(prefix = 'peptide_matcher') as workdir:
+        databases = load_databases(specs, sst_included, workdir)
+        if socket_path:
+            if os.path.lexists(socket_path):
+                check_socket_path(socket_path)
+                os.unlink(socket_path)
+            server = UnixMatchServer(socket_path, MatchHandler)
+        else:
+            server = MatchServer((host, port), MatchHandler)
+        server.databases = databases
+        server.automaton_cache = pmCache.AutomatonCache(automaton_cache) if automaton_cache else None
+        server.metrics = Metrics()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if socket_path:
+                os.unlink(socket_path)
+            for database in databases.values():
+                database.close()
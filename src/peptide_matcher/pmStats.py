@@ -0,0 +1,93 @@
+from time import perf_counter
+import sys
+
+STAGES = [ 'parse', 'scan', 'decode', 'aggregate' ]
+INTERVAL = 0.2
+
+# Counters of a run: records and residues scanned, bytes of the database read,
+# hits found, peptides with hits from the result cache and the seconds spent per
+# stage (parsing the database, scanning it, decoding the structural annotations
+# of records with hits and aggregating the hits into matches and logos). With
+# several worker processes the parse and scan times are summed over the workers.
+# The callback, if any, is called with the stats at most every interval seconds
+# while the database is scanned, and once more when the run is done.
+class Stats:
+
+    def __init__(self, callback = None, interval = INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.records = 0
+        self.residues = 0
+        self.bytes_read = 0
+        self.bytes_total = None
+        self.hits = 0
+        # peptides whose hits came from the result cache
+        self.cached = 0
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.stage = 'scan'
+        self.started = perf_counter()
+        self.elapsed = 0.0
+        self.last_update = self.started
+
+    @property
+    def fraction(self):
+        if not self.bytes_total:
+            return None
+        return min(self.bytes_read / self.bytes_total, 1.0)
+
+    def add_records(self, records, residues, bytes_read, parse_seconds, scan_seconds):
+        self.records += records
+        self.residues += residues
+        self.bytes_read += bytes_read
+        self.times['parse'] += parse_seconds
+        self.times['scan'] += scan_seconds
+        self.update()
+
+    def add_time(self, stage, seconds):
+        self.times[stage] += seconds
+
+    def update(self, force = False):
+        now = perf_counter()
+        self.elapsed = now - self.started
+        if self.callback is not None and (force or now - self.last_update >= self.interval):
+            self.last_update = now
+            self.callback(self)
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.update(force = True)
+
+    def merge(self, counters):
+        self.add_records(counters['records'], counters['residues'], counters['bytes_read'], counters['times']['parse'], counters['times']['scan'])
+
+    def as_dict(self):
+        return {
+            'records': self.records,
+            'residues': self.residues,
+            'bytes_read': self.bytes_read,
+            'bytes_total': self.bytes_total,
+            'hits': self.hits,
+            'cached': self.cached,
+            'times': dict(self.times),
+            'elapsed': self.elapsed
+        }
+
+# a progress bar on stderr, as a Stats callback
+class ProgressBar:
+
+    width = 30
+
+    def __init__(self, stream = sys.stderr):
+        self.stream = stream
+
+    def __call__(self, stats):
+        fraction = stats.fraction
+        if fraction is None:
+            bar = ''
+        else:
+            filled = int(fraction * self.width)
+            bar = '[%s%s] %5.1f%% ' % ('#' * filled, ' ' * (self.width - filled), fraction * 100)
+        self.stream.write('\r%s%d records, %d hits, %.1fs %-9s' % (bar, stats.records, stats.hits, stats.elapsed, stats.stage))
+        if stats.stage == 'done':
+            self.stream.write('\n')
+        self.stream.flush()
@@ -0,0 +1,43 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+
+# keeps the finished matches in a temporary sqlite file instead of memory,
+# so that neither the matches nor the records with hits stay around
+class SpillStore:
+
+    batch_size = 10000
+
+    def __init__(self, matcher, directory = None):
+        self.matcher = matcher
+        fd, self.path = tempfile.mkstemp(suffix = '.sqlite', dir = directory if isinstance(directory, str) else None)
+        os.close(fd)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE hits (peptide TEXT, match BLOB)')
+        self.batch = []
+        self.indexed = False
+
+    def add(self, peptide, record, start_index, end):
+        match = self.matcher.match(record, start_index, end, peptide)
+        self.batch.append((peptide, pickle.dumps(match, pickle.HIGHEST_PROTOCOL)))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany('INSERT INTO hits VALUES (?, ?)', self.batch)
+        self.batch = []
+
+    def matches(self, peptide):
+        if not self.indexed:
+            self.flush()
+            self.db.execute('CREATE INDEX hits_peptide ON hits (peptide)')
+            self.indexed = True
+        cursor = self.db.execute('SELECT match FROM hits WHERE peptide = ? ORDER BY rowid', (peptide,))
+        return [ pickle.loads(match) for match, in cursor ]
+
+    def close(self):
+        self.db.close()
+        os.unlink(self.path)
@@ -0,0 +1,169 @@
+from peptide_matcher.pmDatabase import temp_file
+from time import perf_counter
+import numpy as np
+import mmap
+import os
+import struct
+import tempfile
+
+# Suffix array of the residue blob of an indexed database, kept in a file next to
+# the database: a header followed by the suffix positions as little-endian int32
+# (int64 for blobs of 2 GB and more). The records in the blob are separated by
+# newlines, so a peptide found in the suffix array never spans two records.
+MAGIC = b'PMSA'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQI')
+SUFFIX = '.sa'
+
+# prefix doubling: the suffixes are first sorted by their leading 8 residues packed
+# into one integer, then by their first 2k residues using the ranks of the first k
+# residues, until all ranks are distinct
+def suffix_array(text):
+    n = len(text)
+    dtype = np.int32 if n < 1 << 31 else np.int64
+    padded = np.zeros(n + 8, dtype = np.uint64)
+    padded[:n] = np.frombuffer(text, dtype = np.uint8)
+    first = np.zeros(n, dtype = np.uint64)
+    for i in range(8):
+        first = (first << np.uint64(8)) | padded[i:i + n]
+    sa = np.argsort(first, kind = 'stable').astype(dtype)
+    rank = np.empty(n, dtype = dtype)
+    second = None
+    k = 8
+    while n:
+        keys = first[sa] if second is None else rank[sa]
+        diff = np.empty(n, dtype = bool)
+        diff[0] = True
+        diff[1:] = keys[1:] != keys[:-1]
+        if second is not None:
+            keys = second[sa]
+            diff[1:] |= keys[1:] != keys[:-1]
+        rank[sa] = np.cumsum(diff, dtype = dtype) - 1
+        if rank[sa[-1]] == n - 1 or k >= n:
+            break
+        second = np.full(n, -1, dtype = dtype)
+        second[:n - k] = rank[k:]
+        sa = np.lexsort((second, rank)).astype(dtype)
+        k *= 2
+    return sa
+
+def sa_path(database):
+    return database.path + SUFFIX
+
+def write_suffix_array(database, path = None):
+    path = path or sa_path(database)
+    sa = suffix_array(database.blobs['seq'])
+    fd, tmp_path = temp_file(os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, len(sa), database.n_records, sa.itemsize))
+            sa.tofile(out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+class SuffixArray:
+
+    def __init__(self, database, path = None):
+        self.database = database
+        self.path = path or sa_path(database)
+        with open(self.path, 'rb') as fh:
+            self.mmap = mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, n, n_records, itemsize = HEADER.unpack_from(self.mmap)
+        try:
+            assert magic == MAGIC, "'%s' is not a peptide_matcher suffix array" % self.path
+            assert version == VERSION, "Unsupported suffix array version %d in '%s'" % (version, self.path)
+            assert n == len(database.blobs['seq']) and n_records == database.n_records, "The suffix array '%s' does not belong to '%s'" % (self.path, database.path)
+            assert os.path.getmtime(self.path) >= os.path.getmtime(database.path), "The suffix array '%s' is older than '%s'" % (self.path, database.path)
+        except AssertionError:
+            self.mmap.close()
+            raise
+        view = memoryview(self.mmap)
+        self.sa = view[HEADER.size:HEADER.size + n * itemsize].cast('i' if itemsize == 4 else 'q')
+        view.release()
+        self.text = database.mmap
+        self.base = database.sections['seq'][1]
+
+    # the range of suffixes starting with word, searching from lo on
+    def bounds(self, word, lo = 0):
+        sa, text, base, m = self.sa, self.text, self.base, len(word)
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = base + sa[mid]
+            if text[pos:pos + m] < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = base + sa[mid]
+            if text[pos:pos + m] <= word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return first, lo
+
+    # the hits of the words as (record, end_index, word) in the same order as a scan
+    # of the database with an automaton: by end position, longer words first
+    def scan(self, words, stats = None):
+        time_start = perf_counter()
+        words = sorted(words)
+        positions = []
+        word_ids = []
+        lo = 0
+        for i, word in enumerate(words):
+            # the words are sorted, so each search can start where the last one began
+            lo, hi = self.bounds(word.encode('ascii'), lo)
+            if hi > lo:
+                positions.append(np.asarray(self.sa[lo:hi], dtype = np.int64))
+                word_ids.append(np.full(hi - lo, i, dtype = np.int64))
+        database = self.database
+        database.records_scanned = database.n_records
+        if stats is not None:
+            size = len(database.blobs['seq'])
+            stats.add_records(database.n_records, size - database.n_records, size, 0.0, perf_counter() - time_start)
+        if not positions:
+            return
+        word_ids = np.concatenate(word_ids)
+        lengths = np.array([ len(word) for word in words ], dtype = np.int64)[word_ids]
+        ends = np.concatenate(positions) + lengths - 1
+        order = np.lexsort((-lengths, ends))
+        ends = ends[order]
+        offsets = np.asarray(database.offsets['seq'], dtype = np.int64)
+        indices = np.searchsorted(offsets, ends, side = 'right') - 1
+        end_indices = ends - offsets[indices]
+        record = None
+        for index, end_index, word_id in zip(indices.tolist(), end_indices.tolist(), word_ids[order].tolist()):
+            if record is None or record.index != index:
+                record = database.record(index)
+            yield record, end_index, words[word_id]
+
+    def close(self):
+        self.sa.release()
+        self.mmap.close()
+
+# the persisted suffix array of an indexed database, built and saved on first use;
+# if it cannot be saved next to the database it is kept in a temporary file
+def open_suffix_array(database):
+    path = sa_path(database)
+    try:
+        return SuffixArray(database, path)
+    except (OSError, ValueError, AssertionError):
+        pass
+    try:
+        write_suffix_array(database, path)
+        return SuffixArray(database, path)
+    except OSError:
+        pass
+    fd, path = tempfile.mkstemp(suffix = SUFFIX)
+    os.close(fd)
+    try:
+        write_suffix_array(database, path)
+        return SuffixArray(database, path)
+    finally:
+        os.unlink(path)
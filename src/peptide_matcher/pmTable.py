@@ -0,0 +1,218 @@
+from peptide_matcher.pmDatabase import Record, STRUCT_TRACKS
+from peptide_matcher.pmCoverage import ProteinCoverage
+from peptide_matcher.pmLogos import FlankLogos
+from array import array
+import numpy as np
+
+# tracks of numeric scores, their windows read as comma-separated numbers
+SCORE_TRACKS = ('conf', 'acc')
+SCORE_STRINGS = np.array([ str(score) for score in range(256) ])
+
+# Windows of a buffer as fixed-width byte strings: the window bytes (lengths from
+# starts) after a '[' where prefix is set and followed by a ']' where suffix is set.
+# The strings are the same as the sliced windows, also in their sort order.
+def byte_strings(buffer, starts, lengths, prefix, suffix):
+    n = len(starts)
+    width = int(lengths.max()) if n else 0
+    matrix = np.zeros((n, width + 2), dtype = np.uint8)
+    shift = prefix.astype(np.int64)
+    matrix[:, 0] = np.where(prefix, ord('['), 0)
+    if width:
+        positions = np.arange(width)
+        valid = positions < lengths[:, None]
+        window = buffer[np.where(valid, starts[:, None] + positions, 0)]
+        rows = np.arange(n)[:, None]
+        matrix[rows, shift[:, None] + positions] = np.where(valid, window, 0)
+    matrix[np.arange(n), shift + lengths] = np.where(suffix, ord(']'), 0)
+    return matrix.view('S%d' % (width + 2)).ravel().astype(str)
+
+# windows of a score buffer joined as in wrap_scores(), with the '[' and ']' items
+def score_strings(buffer, starts, lengths, prefix, suffix):
+    strings = np.where(prefix, '[', '').astype('U%d' % (4 * int(lengths.max()) + 4 if len(starts) else 4))
+    for i in range(int(lengths.max()) if len(starts) else 0):
+        valid = i < lengths
+        scores = np.where(valid, SCORE_STRINGS[buffer[np.where(valid, starts + i, 0)]], '')
+        strings = np.char.add(np.char.add(strings, np.where(valid & (strings != ''), ',', '')), scores)
+    return np.char.add(strings, np.where(suffix, np.where(strings != '', ',]', ']'), ''))
+
+# Columnar container for the hits of a run. Every hit is a row of four integer
+# columns (peptide, hit record, start index, end); the sequences and structural
+# tracks of the records with hits are concatenated into shared buffers that the
+# flanks and windows are addressed into.
+class MatchTable:
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.flanks = matcher.flanks
+        self.peptides = None
+        self.peptide_ids = None
+        self.columns = { column: array('i') for column in ('peptide', 'record', 'start_index', 'end') }
+        self.record_ids = []
+        self.db_index = array('q')
+        self.seq = bytearray()
+        self.seq_offsets = array('q', [ 0 ])
+        self.tracks = { track: bytearray() for track in STRUCT_TRACKS }
+        self.track_offsets = { track: array('q', [ 0 ]) for track in STRUCT_TRACKS }
+        self.last_record = None
+        self.finished = False
+        self.flank_logos = None
+
+    def add_record(self, record):
+        self.record_ids.append(record.id)
+        self.db_index.append(record.index)
+        self.seq += record.seq.encode('ascii')
+        self.seq_offsets.append(len(self.seq))
+        if self.matcher.sst_included:
+            tracks = self.matcher.record_tracks(record)
+            for track in STRUCT_TRACKS:
+                self.tracks[track] += tracks[track]
+                self.track_offsets[track].append(len(self.tracks[track]))
+        self.last_record = record
+
+    def add(self, peptide, record, start_index, end):
+        if self.peptide_ids is None:
+            self.peptides = list(dict.fromkeys(self.matcher.peptide_seqs))
+            self.peptide_ids = { peptide: i for i, peptide in enumerate(self.peptides) }
+        if record is not self.last_record:
+            self.add_record(record)
+        columns = self.columns
+        columns['peptide'].append(self.peptide_ids[peptide])
+        columns['record'].append(len(self.record_ids) - 1)
+        columns['start_index'].append(start_index)
+        columns['end'].append(end)
+
+    def finish(self):
+        if self.finished:
+            return self
+        if self.peptides is None:
+            self.peptides = list(dict.fromkeys(self.matcher.peptide_seqs))
+            self.peptide_ids = { peptide: i for i, peptide in enumerate(self.peptides) }
+        self.columns = { column: np.frombuffer(values, dtype = np.int32) for column, values in self.columns.items() }
+        self.seq = bytes(self.seq)
+        self.tracks = { track: bytes(buffer) for track, buffer in self.tracks.items() }
+        self.seq_offsets = np.frombuffer(self.seq_offsets, dtype = np.int64)
+        self.track_offsets = { track: np.frombuffer(offsets, dtype = np.int64) for track, offsets in self.track_offsets.items() }
+        self.db_index = np.frombuffer(self.db_index, dtype = np.int64)
+        # rows grouped by peptide, database order is kept within each group
+        self.order = np.argsort(self.columns['peptide'], kind = 'stable')
+        self.bounds = np.searchsorted(self.columns['peptide'][self.order], np.arange(len(self.peptides) + 1))
+        self.last_record = None
+        self.finished = True
+        return self
+
+    def __len__(self):
+        return len(self.columns['peptide'])
+
+    @property
+    def peptide_index(self):
+        return self.columns['peptide']
+
+    @property
+    def record(self):
+        return self.columns['record']
+
+    @property
+    def record_index(self):
+        return self.db_index[self.columns['record']]
+
+    @property
+    def start(self):
+        return self.columns['start_index'] + 1
+
+    @property
+    def end(self):
+        return self.columns['end']
+
+    @property
+    def c_term(self):
+        return self.seq_offsets[self.record + 1] - self.seq_offsets[self.record] - self.end + 1
+
+    @property
+    def seq_buffer(self):
+        return np.frombuffer(self.seq, dtype = np.uint8)
+
+    def track_buffer(self, track):
+        return np.frombuffer(self.tracks[track], dtype = np.uint8)
+
+    # half-open ranges of the flanks in seq_buffer, the terminus symbols are not part of them
+    def n_flank_offsets(self):
+        base = self.seq_offsets[self.record]
+        start_index = self.columns['start_index']
+        return base + np.maximum(start_index - self.flanks, 0), base + start_index
+
+    def c_flank_offsets(self):
+        base = self.seq_offsets[self.record]
+        end = self.end
+        return base + end, np.minimum(base + end + self.flanks, self.seq_offsets[self.record + 1])
+
+    # The text of a window of every hit as in PeptideMatcher.match(): the n-terminal
+    # flank ('n_term'), the peptide span ('pept') or the c-terminal flank ('c_term')
+    # of the sequence ('seq') or of a structural track, with '[' and ']' at the
+    # termini. Records without values of a track give empty windows.
+    def window_strings(self, track, part):
+        self.finish()
+        if track == 'seq':
+            buffer, offsets = self.seq_buffer, self.seq_offsets
+        else:
+            buffer, offsets = self.track_buffer(track), self.track_offsets[track]
+        record = self.record
+        start_index = self.columns['start_index'].astype(np.int64)
+        end = self.end.astype(np.int64)
+        first = offsets[record]
+        last = offsets[record + 1]
+        has_values = last > first
+        closed = np.zeros(len(self), dtype = bool)
+        if part == 'n_term':
+            starts, stops = first + np.maximum(start_index - self.flanks, 0), first + start_index
+            prefix, suffix = (start_index <= self.flanks) & has_values, closed
+        elif part == 'pept':
+            starts, stops = first + start_index, first + end
+            prefix, suffix = closed, closed
+        else:
+            c_open = self.seq_offsets[record + 1] - self.seq_offsets[record] - end <= self.flanks
+            starts, stops = first + end, np.where(c_open, last, first + end + self.flanks)
+            prefix, suffix = closed, c_open & has_values
+        # slices of tracks shorter than the sequence end with the track
+        starts = np.minimum(starts, last)
+        lengths = np.maximum(np.minimum(stops, last) - starts, 0)
+        strings = score_strings if track in SCORE_TRACKS else byte_strings
+        return strings(buffer, starts, lengths, prefix, suffix)
+
+    def rows(self, peptide):
+        peptide_id = self.peptide_ids.get(peptide)
+        if peptide_id is None:
+            return self.order[0:0]
+        return self.order[self.bounds[peptide_id]:self.bounds[peptide_id + 1]]
+
+    # a Record whose sequence and tracks are views on the shared buffers
+    def record_view(self, i):
+        record = Record(int(self.db_index[i]), self.record_ids[i], str(self.seq[self.seq_offsets[i]:self.seq_offsets[i + 1]], 'ascii'))
+        if self.matcher.sst_included:
+            record._tracks = { track: memoryview(self.tracks[track])[self.track_offsets[track][i]:self.track_offsets[track][i + 1]] for track in STRUCT_TRACKS }
+        return record
+
+    def matches(self, peptide):
+        self.finish()
+        matches = []
+        record = None
+        columns = self.columns
+        for row in self.rows(peptide):
+            i = columns['record'][row]
+            if record is None or record_i != i:
+                record = self.record_view(i)
+                record_i = i
+            matches.append(self.matcher.match(record, int(columns['start_index'][row]), int(columns['end'][row]), peptide))
+        return matches
+
+    def logos(self):
+        self.finish()
+        if self.flank_logos is None:
+            self.flank_logos = FlankLogos(self)
+        return self.flank_logos
+
+    # per-protein coverage by the hits of all peptides or of the given ones
+    def coverage(self, peptides = None):
+        return ProteinCoverage(self, peptides)
+
+    def close(self):
+        pass
@@ -0,0 +1,330 @@
+from peptide_matcher.peptideMatcher import wrap_logos, wrap_scores
+from abc import ABC, abstractmethod
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import sys
+import threading
+
+BUFFER_SIZE = 1 << 20
+BATCH_ROWS = 4096
+COMPRESS_LEVEL = 6
+# compressed chunks waiting for the background thread
+QUEUE_CHUNKS = 8
+
+SCORE_FIELDS = { 'mismatch_positions', 'conf_n_term', 'conf_pept', 'conf_c_term', 'acc_n_term', 'acc_pept', 'acc_c_term' }
+SST_FIELDS = { 'sst_n_term', 'sst_pept', 'sst_c_term', 'tm_n_term', 'tm_pept', 'tm_c_term', 'conf_n_term', 'conf_pept', 'conf_c_term', 'acc_n_term', 'acc_pept', 'acc_c_term' }
+
+# Binary file object handing the written chunks to a thread that gzips them into
+# fileobj, so compression overlaps with matching and formatting (zlib releases
+# the GIL while compressing). An error of the thread is raised by the next write
+# or by close(). The gzip header has no timestamp, equal outputs compress to
+# equal files.
+class GzipThreadWriter(io.RawIOBase):
+
+    def __init__(self, fileobj, close_fileobj = True, level = COMPRESS_LEVEL):
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.error = None
+        self.thread = threading.Thread(target = self.compress, args = (fileobj, close_fileobj, level), daemon = True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        data = bytes(data)
+        self.queue.put(data)
+        return len(data)
+
+    def compress(self, fileobj, close_fileobj, level):
+        try:
+            with gzip.GzipFile(fileobj = fileobj, mode = 'wb', compresslevel = level, mtime = 0) as out:
+                while True:
+                    data = self.queue.get()
+                    if data is None: break
+                    out.write(data)
+        except Exception as e:
+            self.error = e
+            # keep the writer from blocking on a full queue
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if close_fileobj:
+                fileobj.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        super().close()
+        if self.error is not None:
+            raise self.error
+
+# A text stream for an output file or stdout ('-') with a large write buffer,
+# gzip compressed on a background thread if compress is set or the name ends
+# with '.gz'. Rows are written with explicit line ends (newline = '').
+def open_output(path, compress = False, buffer_size = BUFFER_SIZE):
+    compress = compress or path.endswith('.gz')
+    if not compress:
+        if path == '-':
+            return sys.stdout
+        return open(path, 'w', buffering = buffer_size, newline = '')
+    if path == '-':
+        sys.stdout.flush()
+        raw = GzipThreadWriter(sys.stdout.buffer, close_fileobj = False)
+    else:
+        raw = GzipThreadWriter(open(path, 'wb'))
+    return io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), encoding = 'utf-8', newline = '')
+
+# Writers take the outputs of PeptideMatcher.run() with write_output() and the
+# matches of PeptideMatcher.stream() with write_match(). A sample name is added
+# to tabular rows if the fieldnames have a 'sample' column; rows_per_sample tells
+# whether a streamed match found in several samples is written once per sample
+# or once with its 'samples' list. close() ends the output and closes the stream
+# if the writer opened it. Subclasses that miss one of the abstract methods fail
+# when they are instantiated.
+class Writer(ABC):
+
+    rows_per_sample = False
+
+    def __init__(self, out, fieldnames = None, sst_included = False):
+        self.out = out
+        self.fieldnames = fieldnames
+        self.sst_included = sst_included
+        self.close_out = False
+
+    @abstractmethod
+    def write_output(self, output):
+        pass
+
+    @abstractmethod
+    def write_match(self, match, sample = None):
+        pass
+
+    def finish(self):
+        pass
+
+    def close(self):
+        self.finish()
+        if self.close_out:
+            self.out.close()
+        else:
+            self.out.flush()
+
+# a JSON array of the outputs or matches
+class JsonWriter(Writer):
+
+    def __init__(self, out, fieldnames = None, sst_included = False):
+        super().__init__(out, fieldnames, sst_included)
+        self.separator = '['
+
+    def write_output(self, output):
+        self.out.write(self.separator)
+        self.out.write(json.dumps(output))
+        self.separator = ','
+
+    def write_match(self, match, sample = None):
+        self.write_output(match)
+
+    def finish(self):
+        if self.separator == '[':
+            self.out.write('[')
+        self.out.write(']\n')
+
+# Newline-delimited JSON, one match per line, so the output can be split into
+# parts at any line. The matches of run() outputs carry the peptide (and sample)
+# and the wrapped logos of the peptide as in the tabular formats; a peptide
+# without matches gives a line with a null record_id.
+class NdjsonWriter(Writer):
+
+    def __init__(self, out, fieldnames = None, sst_included = False):
+        super().__init__(out, fieldnames, sst_included)
+        self.lines = []
+
+    def write_lines(self, lines):
+        self.lines.extend(lines)
+        if len(self.lines) >= BATCH_ROWS:
+            self.flush_lines()
+
+    def flush_lines(self):
+        self.out.write(''.join(self.lines))
+        self.lines = []
+
+    def write_output(self, output):
+        head = { 'sample': output['sample'] } if 'sample' in output else {}
+        head['peptide'] = output['peptide']
+        dumps = json.dumps
+        if not output['matches']:
+            head['record_id'] = None
+            return self.write_lines([ dumps(head) + '\n' ])
+        logos = { 'n_logos': wrap_logos(output['n_logos']), 'c_logos': wrap_logos(output['c_logos']) }
+        self.write_lines([ dumps({ **head, **match, **logos }) + '\n' for match in output['matches'] ])
+
+    def write_match(self, match, sample = None):
+        self.write_lines([ json.dumps(match) + '\n' ])
+
+    def finish(self):
+        self.flush_lines()
+
+# the function giving the value of a tabular field from the sample, peptide, match
+# and wrapped logos of a row, as in match_row()
+def field_getter(field, sst_included):
+    if field == 'sample':
+        return lambda sample, peptide, match, n_logos, c_logos: sample if sample is not None else ''
+    if field == 'peptide':
+        return lambda sample, peptide, match, n_logos, c_logos: peptide
+    if field == 'peplen':
+        return lambda sample, peptide, match, n_logos, c_logos: len(peptide)
+    if field == 'n_logos':
+        return lambda sample, peptide, match, n_logos, c_logos: n_logos
+    if field == 'c_logos':
+        return lambda sample, peptide, match, n_logos, c_logos: c_logos
+    if field in SST_FIELDS and not sst_included:
+        return lambda sample, peptide, match, n_logos, c_logos: ''
+    if field in SCORE_FIELDS:
+        return lambda sample, peptide, match, n_logos, c_logos: wrap_scores(match[field]) if field in match else ''
+    return lambda sample, peptide, match, n_logos, c_logos: match.get(field, '')
+
+# Writers of one row per match (tabular_rows() gives the row values in the order
+# of the fieldnames) with a 'No match' row for peptides without matches.
+class TabularWriter(Writer):
+
+    rows_per_sample = True
+
+    def __init__(self, out, fieldnames, sst_included = False):
+        super().__init__(out, fieldnames, sst_included)
+        self.getters = [ field_getter(field, sst_included) for field in fieldnames ]
+
+    def tabular_rows(self, output):
+        sample = output.get('sample', '')
+        peptide = output['peptide']
+        if not output['matches']:
+            no_match = { 'sample': sample, 'peptide': peptide, 'peplen': len(peptide), 'record_id': 'No match' }
+            return [ [ no_match.get(field, '') for field in self.fieldnames ] ]
+        n_logos = wrap_logos(output['n_logos'])
+        c_logos = wrap_logos(output['c_logos'])
+        getters = self.getters
+        return [ [ get(sample, peptide, match, n_logos, c_logos) for get in getters ] for match in output['matches'] ]
+
+    def match_row(self, match, sample):
+        return [ get(sample, match['peptide'], match, '', '') for get in self.getters ]
+
+    @abstractmethod
+    def write_rows(self, rows):
+        pass
+
+    def write_output(self, output):
+        self.write_rows(self.tabular_rows(output))
+
+    def write_match(self, match, sample = None):
+        self.write_rows([ self.match_row(match, sample) ])
+
+# Delimited text, formatted in batches of joined lines. The lines are the same
+# as those of csv.DictWriter; the rare rows with a delimiter, quote or line break
+# in a value are left to the csv module for quoting.
+class TsvWriter(TabularWriter):
+
+    delimiter = '\t'
+
+    def __init__(self, out, fieldnames, sst_included = False):
+        super().__init__(out, fieldnames, sst_included)
+        self.lines = []
+        self.buffer = io.StringIO()
+        self.csv_writer = csv.writer(self.buffer, delimiter = self.delimiter)
+        self.write_rows([ fieldnames ])
+
+    def write_rows(self, rows):
+        delimiter = self.delimiter
+        n_delimiters = len(self.fieldnames) - 1
+        lines = self.lines
+        for row in rows:
+            line = delimiter.join(map(str, row))
+            if line.count(delimiter) != n_delimiters or '"' in line or '\n' in line or '\r' in line:
+                self.csv_writer.writerow(row)
+                line = self.buffer.getvalue()
+                self.buffer.seek(0)
+                self.buffer.truncate()
+                lines.append(line)
+            else:
+                lines.append(line + '\r\n')
+        if len(lines) >= BATCH_ROWS:
+            self.flush_lines()
+
+    def flush_lines(self):
+        self.out.write(''.join(self.lines))
+        self.lines = []
+
+    def finish(self):
+        self.flush_lines()
+
+class CsvWriter(TsvWriter):
+
+    delimiter = ','
+
+# the xlsx writer imports xlsxwriter, which is only needed for that format
+def xlsx_writer(path, fieldnames, sst_included = False):
+    try:
+        from peptide_matcher.pmXlsx import XlsxWriter
+    except ModuleNotFoundError as e:
+        if e.name != 'xlsxwriter':
+            raise
+        raise ImportError('The xlsx format needs the xlsxwriter package (pip install peptide_matcher[xlsx])')
+    return XlsxWriter(path, fieldnames, sst_included = sst_included)
+
+WRITERS = {
+    'json': JsonWriter,
+    'ndjson': NdjsonWriter,
+    'tsv': TsvWriter,
+    'csv': CsvWriter
+}
+# formats written to a file name instead of a text stream, without compression
+PATH_WRITERS = {
+    'xlsx': xlsx_writer
+}
+FORMATS = list(WRITERS) + list(PATH_WRITERS)
+
+# the writer of a format for an output file or stdout ('-')
+def open_writer(output_format, path, fieldnames, sst_included = False, compress = False):
+    if output_format in PATH_WRITERS:
+        if path == '-' or compress or path.endswith('.gz'):
+            raise ValueError('The %s format needs an uncompressed output file' % output_format)
+        return PATH_WRITERS[output_format](path, fieldnames, sst_included)
+    if output_format not in WRITERS:
+        raise ValueError("Unknown format '%s'" % output_format)
+    out = open_output(path, compress)
+    writer = WRITERS[output_format](out, fieldnames, sst_included)
+    writer.close_out = out is not sys.stdout
+    return writer
+
+# A table of dict rows (such as the protein coverage) in the format told by the
+# file name: .json, .ndjson, .csv, .xlsx or else tab-separated; a .gz suffix
+# compresses the text formats.
+def write_table(path, fieldnames, rows):
+    base, extension = os.path.splitext(path[:-3] if path.endswith('.gz') else path)
+    if extension == '.xlsx':
+        writer = xlsx_writer(path, fieldnames)
+        for row in rows:
+            writer.writerow(row)
+        writer.close()
+        return
+    out = open_output(path)
+    if extension == '.json':
+        out.write('[')
+        out.write(','.join(json.dumps(row) for row in rows))
+        out.write(']\n')
+    elif extension == '.ndjson':
+        out.writelines(json.dumps(row) + '\n' for row in rows)
+    else:
+        writer = csv.DictWriter(out, delimiter = ',' if extension == '.csv' else '\t', fieldnames = fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    if out is sys.stdout:
+        out.flush()
+    else:
+        out.close()
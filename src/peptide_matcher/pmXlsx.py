@@ -0,0 +1,58 @@
+from peptide_matcher.pmWriters import TabularWriter
+import xlsxwriter
+
+# rows per worksheet in Excel, the header included
+MAX_ROWS = 1048576
+NUMERIC_FIELDS = { 'peplen', 'start', 'end', 'c_term', 'mismatches', 'length', 'peptides', 'unique_peptides', 'shared_peptides', 'hits', 'covered', 'unique_covered', 'coverage', 'helix', 'helix_covered', 'strand', 'strand_covered', 'membrane', 'membrane_covered', 'exposed', 'exposed_covered' }
+
+# Writes tabular rows (those of the other tabular writers, or dicts as given by
+# match_row() with writerow()) to an xlsx file in xlsxwriter's constant_memory
+# mode, so every row is flushed to disk once the next one is started. Counts and
+# positions are stored as numbers. Rows past the row limit of a worksheet go to
+# further worksheets, each with its own header, unless split is False.
+class XlsxWriter(TabularWriter):
+
+    def __init__(self, path, fieldnames, labels = None, split = True, max_rows = MAX_ROWS, sheet_name = 'Matches', sst_included = False):
+        super().__init__(None, fieldnames, sst_included)
+        self.workbook = xlsxwriter.Workbook(path, { 'constant_memory': True })
+        self.labels = labels or fieldnames
+        self.numeric = [ field in NUMERIC_FIELDS for field in fieldnames ]
+        self.split = split
+        self.max_rows = max_rows
+        self.sheet_name = sheet_name
+        self.header_format = self.workbook.add_format({ 'bold': True })
+        self.worksheet = None
+        self.n_sheets = 0
+        self.row = 0
+        self.add_worksheet()
+
+    def add_worksheet(self):
+        self.n_sheets += 1
+        name = self.sheet_name if self.n_sheets == 1 else '%s %d' % (self.sheet_name, self.n_sheets)
+        self.worksheet = self.workbook.add_worksheet(name)
+        for col, label in enumerate(self.labels):
+            self.worksheet.write_string(0, col, label, self.header_format)
+        self.row = 1
+
+    def write_rows(self, rows):
+        numeric = self.numeric
+        for row in rows:
+            if self.row >= self.max_rows:
+                if not self.split:
+                    raise ValueError('More than %d rows do not fit into one worksheet' % (self.max_rows - 1))
+                self.add_worksheet()
+            worksheet = self.worksheet
+            for col, value in enumerate(row):
+                if value is None or value == '':
+                    continue
+                if numeric[col]:
+                    worksheet.write_number(self.row, col, value)
+                else:
+                    worksheet.write_string(self.row, col, str(value))
+            self.row += 1
+
+    def writerow(self, fields):
+        self.write_rows([ [ fields.get(field) for field in self.fieldnames ] ])
+
+    def close(self):
+        self.workbook.close()
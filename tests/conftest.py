@@ -0,0 +1,24 @@
+from peptide_matcher import pmDatabase
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks'))
+import generate
+
+# A small synthetic proteome with structural annotations, as fasta and indexed. The
+# peptides are those of the generator (found in up to three proteins, some without
+# hits), peptides at the termini of the proteins and short ones with many hits.
+@pytest.fixture(scope = 'session')
+def proteome(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('proteome')
+    fasta = str(directory / 'proteome.fasta')
+    peptide_list = str(directory / 'peptides.txt')
+    generate.generate(fasta, peptide_list, n_records = 300, mean_length = 200, secstruct = True, n_peptides = 150, multiplicity = 3, seed = 7)
+    with open(peptide_list) as fh:
+        peptides = fh.read().split()
+    seqs = [ seq for title, seq in pmDatabase.FastaDatabase(fasta, False).parse() ]
+    peptides += [ seq[:6] for seq in seqs[:20] ] + [ seq[-6:] for seq in seqs[20:40] ] + [ 'KEL', 'GGA', 'LLS' ]
+    indexed = str(directory / 'proteome.pmdb')
+    pmDatabase.build_index(fasta, indexed, True)
+    return { 'fasta': fasta, 'indexed': indexed, 'peptides': peptides }
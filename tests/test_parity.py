@@ -0,0 +1,39 @@
+from peptide_matcher import PeptideMatcher
+import pytest
+
+FLANKS = [ 0, 1, 4, 12 ]
+
+def run(proteome, database, flanks, **options):
+    return list(PeptideMatcher(proteome['peptides'], proteome[database], True, flanks, **options).run())
+
+# the outputs of a serial automaton scan of the fasta database, the reference of all
+# other ways to run the same search
+@pytest.fixture(scope = 'session')
+def serial(proteome):
+    outputs = {}
+    def serial_run(flanks):
+        if flanks not in outputs:
+            outputs[flanks] = run(proteome, 'fasta', flanks)
+        return outputs[flanks]
+    return serial_run
+
+def test_reference_has_matches(proteome, serial):
+    outputs = serial(4)
+    assert len(outputs) == len(proteome['peptides'])
+    assert sum(len(output['matches']) for output in outputs) > len(outputs)
+    assert any(not output['matches'] for output in outputs)
+
+@pytest.mark.parametrize('flanks', FLANKS)
+def test_indexed_database(proteome, serial, flanks):
+    assert run(proteome, 'indexed', flanks) == serial(flanks)
+
+@pytest.mark.parametrize('flanks', FLANKS)
+@pytest.mark.parametrize('database', [ 'fasta', 'indexed' ])
+def test_workers(proteome, serial, database, flanks):
+    assert run(proteome, database, flanks, workers = 3) == serial(flanks)
+
+@pytest.mark.parametrize('flanks', FLANKS)
+@pytest.mark.parametrize('database', [ 'fasta', 'indexed' ])
+@pytest.mark.parametrize('engine', [ 'suffix-array', 'auto' ])
+def test_suffix_array(proteome, serial, engine, database, flanks):
+    assert run(proteome, database, flanks, engine = engine) == serial(flanks)